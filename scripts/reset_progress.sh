@@ -2,8 +2,9 @@
 
 # Get the directory where the script is located
 SCRIPT_DIR="$( cd "$( dirname "${BASH_SOURCE[0]}" )" && pwd )"
-PROGRESS_FILE="$SCRIPT_DIR/progress.yaml"
-BACKUP_DIR="$SCRIPT_DIR/progress_backups"
+PROJECT_DIR="$(dirname "$SCRIPT_DIR")"
+PROGRESS_FILE="$PROJECT_DIR/data/progress/progress.yaml"
+BACKUP_DIR="$PROJECT_DIR/data/backups"
 
 # Create backup directory if it doesn't exist
 mkdir -p "$BACKUP_DIR"
@@ -16,10 +17,26 @@ if [ -f "$PROGRESS_FILE" ]; then
     echo "Created backup of current progress at: $BACKUP_FILE"
 fi
 
+# Move the progress database aside; the fresh progress.yaml is imported on next start
+PROGRESS_DB="$PROJECT_DIR/data/progress/progress.sqlite"
+if [ -f "$PROGRESS_DB" ]; then
+    DB_BACKUP="$BACKUP_DIR/progress_$(date +"%Y%m%d_%H%M%S").sqlite"
+    # Fold the write-ahead log into the database so the backup holds the latest commits
+    if command -v sqlite3 > /dev/null; then
+        sqlite3 "$PROGRESS_DB" 'PRAGMA wal_checkpoint(TRUNCATE);' > /dev/null
+    fi
+    mv "$PROGRESS_DB" "$DB_BACKUP"
+    # Whatever is still in the log (no sqlite3, or the app was running) goes with the backup
+    if [ -s "$PROGRESS_DB-wal" ]; then
+        mv "$PROGRESS_DB-wal" "$DB_BACKUP-wal"
+    fi
+    rm -f "$PROGRESS_DB-wal" "$PROGRESS_DB-shm"
+fi
+
 # Create fresh progress file
 cat > "$PROGRESS_FILE" << 'EOF'
 modules: {}
 EOF
 
 echo "Progress has been reset to default state (all tasks pending)"
-echo "A backup of your previous progress has been saved in the progress_backups directory" 
\ No newline at end of file
+echo "A backup of your previous progress has been saved in the data/backups directory" 
\ No newline at end of file
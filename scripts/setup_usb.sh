@@ -25,8 +25,7 @@ mkdir -p "$USB_PATH/cybercrate/tools/portable/h8mail"
 mkdir -p "$USB_PATH/cybercrate/tools/portable/theharvester"
 
 # Copy core application files
-cp "$PROJECT_ROOT/src/core/main.py" "$USB_PATH/cybercrate/src/core/"
-cp "$PROJECT_ROOT/src/core/crate_builder.py" "$USB_PATH/cybercrate/src/core/"
+cp "$PROJECT_ROOT/src/core/"*.py "$USB_PATH/cybercrate/src/core/"
 
 # Copy utils (if any)
 if [ -d "$PROJECT_ROOT/src/utils" ]; then
@@ -52,6 +51,10 @@ if [ -d "$PROJECT_ROOT/cheatsheets" ]; then
     cp -r "$PROJECT_ROOT/cheatsheets"/* "$USB_PATH/cybercrate/cheatsheets/"
 fi
 
+# Copy the shared tool modules (job manager, runner, history, storage, logging...)
+cp "$PROJECT_ROOT/tools/__init__.py" "$USB_PATH/cybercrate/tools/"
+cp "$PROJECT_ROOT/tools/portable/"*.py "$USB_PATH/cybercrate/tools/portable/"
+
 # Copy all tools, including nmap and h8mail, with their LICENSE and README
 cp -r "$PROJECT_ROOT/tools/portable/nmap"/* "$USB_PATH/cybercrate/tools/portable/nmap/"
 cp -r "$PROJECT_ROOT/tools/portable/h8mail"/* "$USB_PATH/cybercrate/tools/portable/h8mail/"
@@ -73,6 +76,9 @@ pip install --upgrade pip
 pip install --upgrade -r requirements.txt
 # Install theHarvester from GitHub (not PyPI)
 pip install --upgrade git+https://github.com/laramies/theHarvester.git
+# Build a wheelhouse so the tools' own venvs can be provisioned offline
+mkdir -p "$USB_PATH/cybercrate/tools/portable/wheelhouse"
+pip wheel -w "$USB_PATH/cybercrate/tools/portable/wheelhouse" h8mail waitress git+https://github.com/laramies/theHarvester.git
 # Clear pip cache
 pip cache purge
 
@@ -81,16 +87,16 @@ sudo mkdir -p /usr/local/etc/theHarvester
 sudo chown -R $(whoami) /usr/local/etc/theHarvester
 
 # Create a launcher script
-cat > "$USB_PATH/cybercrate/start_cybercrate.sh" << EOF
+cat > "$USB_PATH/cybercrate/start_cybercrate.sh" << 'EOF'
 #!/bin/bash
 cd "$(dirname "$0")"
 source venv/bin/activate
 export PYTHONPATH="$PYTHONPATH:$(pwd)"
-python3 src/core/main.py
+python3 src/core/main.py --production
 EOF
 
 # Create reset progress script
-cat > "$USB_PATH/cybercrate/reset_progress.sh" << RESET_EOF
+cat > "$USB_PATH/cybercrate/reset_progress.sh" << 'RESET_EOF'
 #!/bin/bash
 
 # Get the directory where the script is located
@@ -109,6 +115,22 @@ if [ -f "$PROGRESS_FILE" ]; then
     echo "Created backup of current progress at: $BACKUP_FILE"
 fi
 
+# Move the progress database aside; the fresh progress.yaml is imported on next start
+PROGRESS_DB="$SCRIPT_DIR/data/progress/progress.sqlite"
+if [ -f "$PROGRESS_DB" ]; then
+    DB_BACKUP="$BACKUP_DIR/progress_$(date +"%Y%m%d_%H%M%S").sqlite"
+    # Fold the write-ahead log into the database so the backup holds the latest commits
+    if command -v sqlite3 > /dev/null; then
+        sqlite3 "$PROGRESS_DB" 'PRAGMA wal_checkpoint(TRUNCATE);' > /dev/null
+    fi
+    mv "$PROGRESS_DB" "$DB_BACKUP"
+    # Whatever is still in the log (no sqlite3, or the app was running) goes with the backup
+    if [ -s "$PROGRESS_DB-wal" ]; then
+        mv "$PROGRESS_DB-wal" "$DB_BACKUP-wal"
+    fi
+    rm -f "$PROGRESS_DB-wal" "$PROGRESS_DB-shm"
+fi
+
 # Create fresh progress file
 cat > "$PROGRESS_FILE" << PROGRESS_EOF
 modules: {}
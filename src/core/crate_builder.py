@@ -1,29 +1,52 @@
 #!/usr/bin/env python3
 import os
+import sys
 import json
 import yaml
 import zipfile
+import time
 import hashlib
+import argparse
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-def calculate_file_hash(file_path):
-    """Calculate SHA-256 hash of a file."""
-    sha256_hash = hashlib.sha256()
-    with open(file_path, "rb") as f:
-        for byte_block in iter(lambda: f.read(4096), b""):
-            sha256_hash.update(byte_block)
-    return sha256_hash.hexdigest()
+# Add the project root to the Python path
+project_root = Path(__file__).parent.parent.parent
+sys.path.append(str(project_root))
 
-def process_task_file(task_file):
-    """Process a task file (YAML or JSON) and return its contents as a list of tasks."""
+from src.core.merkle import MERKLE_CHUNK_SIZE, FileHasher, crate_root
+
+# Bumped whenever the crate layout changes, invalidating the build cache
+BUILD_FORMAT = 2
+
+# Per-module source fingerprints, kept next to the module directories
+BUILD_CACHE_NAME = '.build_cache.json'
+
+# Files are read, hashed and compressed in blocks of this size
+BUFFER_SIZE = MERKLE_CHUNK_SIZE
+
+# Members larger than this need ZIP64 headers up front when streamed in
+ZIP64_THRESHOLD = 0x7FFFFFFF
+
+# Already-compressed formats that gain nothing from deflate
+STORED_SUFFIXES = {
+    '.gz', '.tgz', '.bz2', '.xz', '.zst', '.zip', '.7z', '.rar', '.crate',
+    '.png', '.jpg', '.jpeg', '.gif', '.webp', '.mp4', '.mp3', '.pdf', '.iso'
+}
+
+def load_task_data(task_file):
+    """Parse a task file (YAML or JSON) and return the raw data."""
     task_file = Path(task_file)
     with open(task_file, 'r') as f:
         if task_file.suffix in ['.yaml', '.yml']:
-            data = yaml.safe_load(f)
+            return yaml.safe_load(f)
         elif task_file.suffix == '.json':
-            data = json.load(f)
+            return json.load(f)
         else:
             raise ValueError(f"Unsupported task file format: {task_file}")
+
+def extract_tasks(data):
+    """Return the list of tasks held in parsed task file data."""
     # If the data is a dict with a 'tasks' key, extract the list
     if isinstance(data, dict) and 'tasks' in data:
         return data['tasks']
@@ -33,85 +56,277 @@ def process_task_file(task_file):
     # Otherwise, wrap in a list
     return [data]
 
+def process_task_file(task_file):
+    """Process a task file (YAML or JSON) and return its contents as a list of tasks."""
+    return extract_tasks(load_task_data(task_file))
+
+def add_file(crate, file_path, arcname, buffer_size=BUFFER_SIZE, known_hashes=None):
+    """Compress a file into the crate while hashing it, reading it only once.
+
+    ``known_hashes`` is a (sha256, tree) pair from the build cache for a
+    file that hasn't changed; the file is then copied without hashing.
+    """
+    zinfo = zipfile.ZipInfo.from_file(file_path, arcname)
+    # Already-compressed payloads are stored, which also lets the server range-seek them
+    if file_path.suffix.lower() in STORED_SUFFIXES:
+        zinfo.compress_type = zipfile.ZIP_STORED
+    else:
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+    hasher = None if known_hashes else FileHasher(MERKLE_CHUNK_SIZE)
+    with open(file_path, 'rb') as src, crate.open(zinfo, 'w', force_zip64=zinfo.file_size > ZIP64_THRESHOLD) as dst:
+        for byte_block in iter(lambda: src.read(buffer_size), b""):
+            if hasher:
+                hasher.update(byte_block)
+            dst.write(byte_block)
+    if known_hashes:
+        return known_hashes
+    return hasher.hexdigest(), hasher.tree()
+
+def scan_module(module_dir):
+    """Return {relative path: (path, size, mtime_ns)} for every file in a module."""
+    module_dir = Path(module_dir)
+    files = {}
+    for path in module_dir.glob('**/*'):
+        if path.is_file():
+            stat = path.stat()
+            files[path.relative_to(module_dir).as_posix()] = (path, stat.st_size, stat.st_mtime_ns)
+    return files
+
+def module_fingerprint(files):
+    """Fingerprint of a module's sources from the (path, size, mtime) of each file."""
+    fingerprint = hashlib.sha256(f"{BUILD_FORMAT}\n".encode())
+    for rel_path in sorted(files):
+        _, size, mtime_ns = files[rel_path]
+        fingerprint.update(f"{rel_path}\0{size}\0{mtime_ns}\n".encode())
+    return fingerprint.hexdigest()
+
 def build_crate(module_dir, output_dir):
     """Build a .crate file from a module directory."""
+    crate_path, _ = build_crate_cached(module_dir, output_dir)
+    return crate_path
+
+def build_crate_cached(module_dir, output_dir, cached_files=None):
+    """Build a .crate file, reusing hashes of files unchanged since the last build.
+
+    ``cached_files`` is the module's ``files`` map from the build cache.
+    Returns the crate path and the updated map for the cache.
+    """
     module_dir = Path(module_dir)
     output_dir = Path(output_dir)
+    cached_files = cached_files or {}
     
     # Ensure output directory exists
     output_dir.mkdir(parents=True, exist_ok=True)
     
+    # Walk the module once; everything below works from this list
+    sources = scan_module(module_dir)
+    files = sorted(path for path, _, _ in sources.values())
+    file_records = {}
+    
     # Find task files
-    task_files = list(module_dir.glob('**/*.yaml')) + list(module_dir.glob('**/*.json'))
+    task_files = [path for path in files if path.suffix == '.yaml'] + [path for path in files if path.suffix == '.json']
     if not task_files:
         raise ValueError(f"No task files found in {module_dir}")
     
-    # Process task files
+    # Process task files, parsing each one once
     tasks = []
     module_name = module_dir.name
     for task_file in task_files:
-        # Load the raw data to extract the name if present
-        with open(task_file, 'r') as f:
-            if task_file.suffix in ['.yaml', '.yml']:
-                data = yaml.safe_load(f)
-            elif task_file.suffix == '.json':
-                data = json.load(f)
-            else:
-                raise ValueError(f"Unsupported task file format: {task_file}")
+        data = load_task_data(task_file)
         if isinstance(data, dict) and 'name' in data:
             module_name = data['name']
-        # Now extract the tasks as before
-        tasks.extend(process_task_file(task_file))
+        tasks.extend(extract_tasks(data))
     
     # Create manifest
     manifest = {
         "version": "1.0",
         "name": module_name,
         "hashes": {},
+        "merkle": {
+            "algorithm": "sha256",
+            "chunk_size": MERKLE_CHUNK_SIZE,
+            "root": None,
+            "files": {}
+        },
         "tasks": tasks
     }
     
-    # Calculate hashes for all files
-    for file_path in module_dir.glob('**/*'):
-        if file_path.is_file():
-            rel_path = file_path.relative_to(module_dir)
-            manifest['hashes'][str(rel_path)] = calculate_file_hash(file_path)
-    
-    # Create crate file
+    # Create crate file. Each file is hashed (including the per-chunk hashes
+    # the server uses for lazy verification) while it is compressed, and the
+    # manifest goes in last once all hashes are known. The crate is written
+    # under a temporary name so readers never see a half-built archive.
     crate_name = module_dir.name + '.crate'
     crate_path = output_dir / crate_name
+    temp_path = output_dir / (crate_name + '.tmp')
     
-    with zipfile.ZipFile(crate_path, 'w', zipfile.ZIP_DEFLATED) as crate:
-        # Add manifest
-        crate.writestr('manifest.json', json.dumps(manifest, indent=2))
-        
-        # Add all files
-        for file_path in module_dir.glob('**/*'):
-            if file_path.is_file():
-                rel_path = file_path.relative_to(module_dir)
-                crate.write(file_path, rel_path)
+    try:
+        with zipfile.ZipFile(temp_path, 'w', zipfile.ZIP_DEFLATED) as crate:
+            for file_path in files:
+                rel_path = file_path.relative_to(module_dir).as_posix()
+                _, size, mtime_ns = sources[rel_path]
+                record = cached_files.get(rel_path)
+                known_hashes = None
+                if record and record['size'] == size and record['mtime_ns'] == mtime_ns:
+                    known_hashes = (record['sha256'], record['tree'])
+                file_hash, file_tree = add_file(crate, file_path, rel_path, known_hashes=known_hashes)
+                file_records[rel_path] = {
+                    'size': size,
+                    'mtime_ns': mtime_ns,
+                    'sha256': file_hash,
+                    'tree': file_tree
+                }
+                manifest['hashes'][rel_path] = file_hash
+                manifest['merkle']['files'][rel_path] = file_tree
+            manifest['merkle']['root'] = crate_root(manifest['merkle']['files'])
+            
+            # Add manifest
+            crate.writestr('manifest.json', json.dumps(manifest, indent=2))
+        os.replace(temp_path, crate_path)
+    except BaseException:
+        if temp_path.exists():
+            temp_path.unlink()
+        raise
     
     print(f"Created crate: {crate_path}")
-    return crate_path
+    return crate_path, file_records
+
+def load_build_cache(cache_file):
+    """Load the build cache, or an empty one if it is missing or from another format."""
+    try:
+        with open(cache_file, 'r') as f:
+            cache = json.load(f)
+        if cache.get('format') == BUILD_FORMAT:
+            return cache
+    except (OSError, ValueError):
+        pass
+    return {'format': BUILD_FORMAT, 'modules': {}}
+
+def save_build_cache(cache_file, cache):
+    """Write the build cache atomically."""
+    temp_file = cache_file.with_name(cache_file.name + '.tmp')
+    with open(temp_file, 'w') as f:
+        json.dump(cache, f)
+    os.replace(temp_file, cache_file)
+
+def rebuild_reason(module_dir, output_dir, cached, force=False):
+    """Return why a module must be rebuilt, or None if its crate is up to date."""
+    if force:
+        return 'forced'
+    if not cached:
+        return 'not in build cache'
+    crate_path = Path(output_dir) / (Path(module_dir).name + '.crate')
+    try:
+        stat = crate_path.stat()
+    except OSError:
+        return 'crate missing'
+    if [stat.st_size, stat.st_mtime_ns] != cached.get('crate'):
+        return 'crate modified since last build'
+    sources = scan_module(module_dir)
+    if module_fingerprint(sources) == cached.get('fingerprint'):
+        return None
+    old_files = cached.get('files', {})
+    added = sorted(set(sources) - set(old_files))
+    removed = sorted(set(old_files) - set(sources))
+    changed = sorted(rel_path for rel_path in set(sources) & set(old_files)
+                     if list(sources[rel_path][1:]) != [old_files[rel_path]['size'], old_files[rel_path]['mtime_ns']])
+    reasons = []
+    for label, paths in (('added', added), ('removed', removed), ('changed', changed)):
+        if paths:
+            reasons.append(f"{label}: {', '.join(paths)}")
+    return '; '.join(reasons) or 'sources changed'
+
+def build_module(module_dir, output_dir, cached_files=None):
+    """Build one module and return its result dict; used by the process pool."""
+    started = time.perf_counter()
+    result = {'module_dir': module_dir, 'crate_path': None, 'files': None, 'error': None}
+    try:
+        # Fingerprint what we are about to build, so edits made mid-build trigger a rebuild next time
+        result['fingerprint'] = module_fingerprint(scan_module(module_dir))
+        result['crate_path'], result['files'] = build_crate_cached(module_dir, output_dir, cached_files)
+    except Exception as e:
+        result['error'] = str(e)
+    result['seconds'] = time.perf_counter() - started
+    return result
+
+def print_report(results, skipped, elapsed):
+    """Print what was rebuilt and why, with per-module timings."""
+    built = [r for r in results if r['error'] is None]
+    print(f"\nRebuilt {len(built)}/{len(results)} modules in {elapsed:.2f}s, {len(skipped)} up to date")
+    for result in sorted(results, key=lambda r: str(r['module_dir'])):
+        name = Path(result['module_dir']).name
+        if result['error']:
+            print(f"  {name:<32} {result['seconds']:8.2f}s  FAILED: {result['error']}")
+        else:
+            print(f"  {name:<32} {result['seconds']:8.2f}s  {result['crate_path'].stat().st_size:>10} bytes  ({result['reason']})")
+    for module_dir in skipped:
+        print(f"  {Path(module_dir).name:<32} {'skipped':>9}  (unchanged)")
 
 def main():
-    # Get the project root directory
-    project_root = Path(__file__).parent.parent.parent
+    parser = argparse.ArgumentParser(description='Build .crate files from modules/dev')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help='number of modules to build in parallel (default: CPU count)')
+    parser.add_argument('--force', action='store_true',
+                        help='rebuild every module, ignoring the build cache')
+    args = parser.parse_args()
     
     # Set up paths
     modules_dev_dir = project_root / 'modules' / 'dev'
     modules_crates_dir = project_root / 'modules' / 'crates'
+    cache_file = project_root / 'modules' / BUILD_CACHE_NAME
     
     # Create output directory if it doesn't exist
     modules_crates_dir.mkdir(parents=True, exist_ok=True)
+    cache = load_build_cache(cache_file)
+    
+    # Work out which modules need their crate rebuilt
+    module_dirs = sorted(d for d in modules_dev_dir.iterdir() if d.is_dir())
+    started = time.perf_counter()
+    pending = {}
+    skipped = []
+    for module_dir in module_dirs:
+        cached = cache['modules'].get(module_dir.name)
+        reason = rebuild_reason(module_dir, modules_crates_dir, cached, force=args.force)
+        if reason is None:
+            skipped.append(module_dir)
+        else:
+            pending[module_dir] = reason
+    
+    # Build crates for the changed module directories
+    results = []
+    def cached_files(module_dir):
+        # --force rehashes everything rather than trusting stored hashes
+        if args.force:
+            return None
+        return cache['modules'].get(module_dir.name, {}).get('files')
+    if args.jobs <= 1 or len(pending) <= 1:
+        for module_dir in pending:
+            results.append(build_module(module_dir, modules_crates_dir, cached_files(module_dir)))
+    else:
+        with ProcessPoolExecutor(max_workers=min(args.jobs, len(pending))) as pool:
+            futures = [pool.submit(build_module, module_dir, modules_crates_dir, cached_files(module_dir))
+                       for module_dir in pending]
+            for future in as_completed(futures):
+                results.append(future.result())
     
-    # Build crates for all module directories
-    for module_dir in modules_dev_dir.iterdir():
-        if module_dir.is_dir():
-            try:
-                build_crate(module_dir, modules_crates_dir)
-            except Exception as e:
-                print(f"Error building crate for {module_dir}: {str(e)}")
+    for result in results:
+        module_dir = result['module_dir']
+        result['reason'] = pending[module_dir]
+        if result['error']:
+            print(f"Error building crate for {module_dir}: {result['error']}")
+            cache['modules'].pop(module_dir.name, None)
+            continue
+        stat = result['crate_path'].stat()
+        cache['modules'][module_dir.name] = {
+            'fingerprint': result['fingerprint'],
+            'crate': [stat.st_size, stat.st_mtime_ns],
+            'files': result['files']
+        }
+    # Forget modules that no longer exist in modules/dev
+    for name in list(cache['modules']):
+        if not (modules_dev_dir / name).is_dir():
+            del cache['modules'][name]
+    save_build_cache(cache_file, cache)
+    print_report(results, skipped, time.perf_counter() - started)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+import os
+import json
+import zipfile
+import struct
+import hashlib
+import threading
+import time
+from pathlib import Path
+from tools.portable.logs import get_logger
+
+logger = get_logger('catalog')
+
+# Size of the fixed part of a ZIP local file header
+_LOCAL_HEADER_SIZE = 30
+
+
+def member_data_offset(fp, info):
+    """Return the offset of a member's (compressed) data inside the crate file."""
+    fp.seek(info.header_offset)
+    header = fp.read(_LOCAL_HEADER_SIZE)
+    if len(header) != _LOCAL_HEADER_SIZE or header[:4] != b'PK\x03\x04':
+        raise zipfile.BadZipFile(f"Bad local file header for {info.filename}")
+    name_length, extra_length = struct.unpack('<HH', header[26:30])
+    return info.header_offset + _LOCAL_HEADER_SIZE + name_length + extra_length
+
+
+class CrateEntry:
+    """Metadata for a single .crate file, parsed once from its manifest."""
+
+    def __init__(self, path, size, mtime_ns, manifest, manifest_hash, members):
+        self.path = Path(path)
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.manifest = manifest
+        self.manifest_hash = manifest_hash
+        self.filename = self.path.name
+        self.display_name = manifest.get('name', self.path.stem)
+        # The URL name is the display name with spaces replaced by underscores
+        self.url_name = self.display_name.replace(' ', '_')
+        self.num_tasks = len(manifest.get('tasks', []))
+        # Central directory of the crate, so members can be served without reopening the ZIP
+        self.members = members
+        self._data_offsets = {}
+
+    @property
+    def fingerprint(self):
+        """Identity of this crate version on disk."""
+        return (str(self.path), self.size, self.mtime_ns)
+
+    @property
+    def mtime(self):
+        return self.mtime_ns / 1e9
+
+    def data_offset(self, info):
+        """Return (and remember) where a member's data starts in the crate file."""
+        offset = self._data_offsets.get(info.filename)
+        if offset is None:
+            with open(self.path, 'rb') as fp:
+                offset = member_data_offset(fp, info)
+            self._data_offsets[info.filename] = offset
+        return offset
+
+    def summary(self):
+        """Return the dict shape used by the index page."""
+        return {
+            'filename': self.filename,
+            'display_name': self.display_name,
+            'url_name': self.url_name,
+            'num_tasks': self.num_tasks
+        }
+
+
+class CrateCatalog:
+    """In-memory index of the crates directory.
+
+    Each crate's manifest is parsed once and kept until the file's
+    (size, mtime) changes. Refreshing only stats the directory, so
+    lookups by url_name are a dict hit instead of opening every ZIP.
+    """
+
+    def __init__(self, crates_dir, refresh_interval=2.0):
+        self.crates_dir = Path(crates_dir)
+        self.refresh_interval = refresh_interval
+        self._entries = {}
+        self._by_url_name = {}
+        self._sorted = ()
+        self._failed = {}
+        self._last_refresh = None
+        self._lock = threading.Lock()
+
+    def _load_entry(self, path, stat):
+        with zipfile.ZipFile(path, 'r') as crate:
+            manifest_data = crate.read('manifest.json')
+            members = {info.filename: info for info in crate.infolist()}
+        manifest = json.loads(manifest_data)
+        manifest_hash = hashlib.sha256(manifest_data).hexdigest()
+        return CrateEntry(path, stat.st_size, stat.st_mtime_ns, manifest, manifest_hash, members)
+
+    def _is_fresh(self):
+        return (self._last_refresh is not None
+                and time.monotonic() - self._last_refresh < self.refresh_interval)
+
+    def refresh(self, force=False):
+        """Pick up added, changed and removed crates.
+
+        Readers never wait on each other: within the refresh interval no
+        lock is taken, and while one thread rescans the directory the
+        others keep using the previous (immutable) index.
+        """
+        if not force and self._is_fresh():
+            return
+        if not self._lock.acquire(blocking=force or self._last_refresh is None):
+            return
+        try:
+            if not force and self._is_fresh():
+                return
+            started = time.monotonic()
+
+            seen = {}
+            if self.crates_dir.exists():
+                with os.scandir(self.crates_dir) as it:
+                    for dir_entry in it:
+                        if not dir_entry.name.endswith('.crate') or not dir_entry.is_file():
+                            continue
+                        seen[dir_entry.path] = dir_entry.stat()
+
+            changed = False
+            for path in list(self._entries):
+                if path not in seen:
+                    del self._entries[path]
+                    changed = True
+
+            for path, stat in seen.items():
+                fingerprint = (path, stat.st_size, stat.st_mtime_ns)
+                entry = self._entries.get(path)
+                if entry is not None and entry.fingerprint == fingerprint:
+                    continue
+                # Don't reopen a broken crate until it changes on disk
+                if self._failed.get(path) == fingerprint:
+                    continue
+                try:
+                    self._entries[path] = self._load_entry(path, stat)
+                    self._failed.pop(path, None)
+                except Exception as e:
+                    logger.error("Error reading manifest from %s: %s", path, e)
+                    self._entries.pop(path, None)
+                    self._failed[path] = fingerprint
+                changed = True
+
+            if changed:
+                by_url_name = {}
+                for path in sorted(self._entries):
+                    entry = self._entries[path]
+                    by_url_name.setdefault(entry.url_name, entry)
+                self._by_url_name = by_url_name
+                self._sorted = tuple(sorted(self._entries.values(), key=lambda entry: entry.filename))
+            # Only now, so a first caller racing the initial scan waits for it
+            self._last_refresh = started
+        finally:
+            self._lock.release()
+
+    def entries(self):
+        """Return all known crates, ordered by filename."""
+        self.refresh()
+        return list(self._sorted)
+
+    def get(self, url_name):
+        """Return the crate entry for a url_name, or None."""
+        self.refresh()
+        return self._by_url_name.get(url_name)
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+import zlib
+import zipfile
+import mimetypes
+from flask import Response
+from werkzeug.http import http_date
+from src.core.crate_catalog import member_data_offset
+from src.core.http_cache import CachedBody, is_compressible, accepts_gzip
+from tools.portable.logs import get_logger
+
+logger = get_logger('crates')
+
+# Size of the blocks read from the crate file while streaming a member
+CHUNK_SIZE = 64 * 1024
+
+# Text members up to this size are gzip-compressed once and served from memory
+MAX_PRECOMPRESS_BYTES = 4 * 1024 * 1024
+
+
+def _iter_raw(fp, offset, length, chunk_size):
+    fp.seek(offset)
+    remaining = length
+    while remaining > 0:
+        block = fp.read(min(chunk_size, remaining))
+        if not block:
+            raise zipfile.BadZipFile("Unexpected end of crate data")
+        remaining -= len(block)
+        yield block
+
+
+def _iter_inflated(fp, offset, compress_size, chunk_size):
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    for block in _iter_raw(fp, offset, compress_size, chunk_size):
+        data = decompressor.decompress(block)
+        if data:
+            yield data
+    data = decompressor.flush()
+    if data:
+        yield data
+
+
+def iter_member(crate_path, info, start=0, end=None, data_offset=None, chunk_size=CHUNK_SIZE):
+    """Yield the bytes [start, end) of a crate member without extracting it.
+
+    Stored members are read straight from the crate file, so a range
+    request seeks to the right place. Deflated members are inflated on
+    the fly and the bytes before ``start`` are discarded. Any other
+    compression method falls back to zipfile.
+    """
+    if end is None:
+        end = info.file_size
+    with open(crate_path, 'rb') as fp:
+        if info.flag_bits & 0x1 or info.compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            with zipfile.ZipFile(fp) as crate:
+                source = crate.open(info)
+                chunks = iter(lambda: source.read(chunk_size), b'')
+                yield from _slice_chunks(chunks, start, end)
+            return
+
+        if data_offset is None:
+            data_offset = member_data_offset(fp, info)
+        if info.compress_type == zipfile.ZIP_STORED:
+            yield from _iter_raw(fp, data_offset + start, end - start, chunk_size)
+        else:
+            chunks = _iter_inflated(fp, data_offset, info.compress_size, chunk_size)
+            yield from _slice_chunks(chunks, start, end)
+
+
+def _slice_chunks(chunks, start, end):
+    position = 0
+    for chunk in chunks:
+        chunk_end = position + len(chunk)
+        if chunk_end > start:
+            yield chunk[max(start - position, 0):end - position]
+        position = chunk_end
+        if position >= end:
+            break
+
+
+def resource_etag(entry, info):
+    """Strong ETag for a member, derived from the manifest hash of its crate."""
+    return f"{entry.manifest_hash[:24]}-{info.CRC:08x}"
+
+
+def _if_range_matches(request, entry, etag):
+    if_range = request.if_range
+    if if_range.etag is not None:
+        return if_range.etag == etag
+    if if_range.date is not None:
+        return int(entry.mtime) == int(if_range.date.timestamp())
+    return True
+
+
+def member_response(entry, info, request, verify=None, cache=None):
+    """Build a (possibly partial or 304) response for one crate member.
+
+    Honours If-None-Match / If-Modified-Since, and single byte ranges
+    (with If-Range) so large guides can be resumed or paged. ``verify``,
+    if given, is called with the byte range about to be sent and must
+    return True before any data is streamed.
+
+    With a ``cache`` (an http_cache.ResponseCache), whole text members
+    requested with gzip are compressed once and later served from
+    memory without touching the crate file.
+    """
+    etag = resource_etag(entry, info)
+    length = info.file_size
+    mimetype = mimetypes.guess_type(info.filename)[0] or 'application/octet-stream'
+    headers = {
+        'ETag': f'"{etag}"',
+        'Last-Modified': http_date(entry.mtime),
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'no-cache'
+    }
+    compressible = is_compressible(mimetype)
+    if compressible:
+        headers['Vary'] = 'Accept-Encoding'
+
+    if request.if_none_match:
+        # The gzip copy is the same content, so either ETag validates it
+        if request.if_none_match.contains(etag) or request.if_none_match.contains(f'{etag}-gz'):
+            return Response(status=304, headers=headers)
+    elif request.if_modified_since and int(entry.mtime) <= request.if_modified_since.timestamp():
+        return Response(status=304, headers=headers)
+
+    if (cache is not None and compressible and request.range is None
+            and length <= MAX_PRECOMPRESS_BYTES and accepts_gzip(request)):
+        cached = cache.get(('member', etag), etag)
+        if cached is None:
+            if verify is not None and not verify(0, length):
+                logger.warning("Resource integrity check failed: %s", info.filename)
+                return Response("Resource integrity check failed", status=400)
+            body = b''.join(iter_member(entry.path, info, data_offset=entry.data_offset(info)))
+            cached = cache.put(('member', etag), etag, CachedBody(body, mimetype, etag=etag))
+        if cached.gzipped is not None:
+            headers['ETag'] = f'"{etag}-gz"'
+            headers['Content-Encoding'] = 'gzip'
+            return Response(cached.gzipped, mimetype=mimetype, headers=headers)
+        return Response(cached.body, mimetype=mimetype, headers=headers)
+
+    start, end, status = 0, length, 200
+    byte_range = request.range
+    if byte_range is not None and len(byte_range.ranges) == 1 and _if_range_matches(request, entry, etag):
+        bounds = byte_range.range_for_length(length)
+        if bounds is None:
+            headers['Content-Range'] = f'bytes */{length}'
+            return Response(status=416, headers=headers)
+        start, end = bounds
+        status = 206
+        headers['Content-Range'] = f'bytes {start}-{end - 1}/{length}'
+
+    if verify is not None and not verify(start, end):
+        logger.warning("Resource integrity check failed: %s", info.filename)
+        return Response("Resource integrity check failed", status=400)
+
+    headers['Content-Length'] = str(end - start)
+    data_offset = entry.data_offset(info)
+    body = iter_member(entry.path, info, start, end, data_offset=data_offset)
+    return Response(body, status=status, mimetype=mimetype, headers=headers,
+                    direct_passthrough=True)
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+import os
+import hashlib
+import zipfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from src.core.merkle import chunk_hash, merkle_root, crate_root
+
+# Members are hashed in blocks of this size, so memory stays bounded
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Crates at or above either threshold are hashed on the thread pool
+PARALLEL_MIN_MEMBERS = 8
+PARALLEL_MIN_BYTES = 32 * 1024 * 1024
+
+
+def hash_member(crate_path, info, chunk_size=HASH_CHUNK_SIZE):
+    """Return the SHA-256 of a crate member, streamed in chunks."""
+    sha256_hash = hashlib.sha256()
+    # Each caller gets its own ZipFile so members can be hashed in parallel
+    with zipfile.ZipFile(crate_path, 'r') as crate:
+        with crate.open(info) as member:
+            for block in iter(lambda: member.read(chunk_size), b''):
+                sha256_hash.update(block)
+    return sha256_hash.hexdigest()
+
+
+def crate_fingerprint(crate_path):
+    """Identity of a crate version on disk: (path, size, mtime)."""
+    stat = os.stat(crate_path)
+    return (str(crate_path), stat.st_size, stat.st_mtime_ns)
+
+
+def verify_manifest_tree(manifest):
+    """Check that a manifest's Merkle data is internally consistent.
+
+    Only the manifest is read: every file root must match its chunk
+    hashes and the crate root must match the file roots.
+    """
+    merkle = manifest.get('merkle')
+    if not merkle or merkle.get('algorithm') != 'sha256':
+        return False
+    chunk_size = merkle['chunk_size']
+    files = merkle['files']
+    for tree in files.values():
+        expected_chunks = max(1, -(-tree['size'] // chunk_size))
+        if len(tree['chunks']) != expected_chunks:
+            return False
+        if merkle_root(tree['chunks']) != tree['root']:
+            return False
+    return crate_root(files) == merkle['root']
+
+
+class CrateVerifier:
+    """Verifies crate members against the manifest hashes.
+
+    Results are remembered per crate fingerprint, so an unchanged crate
+    is hashed once per process no matter how often it is viewed. Crates
+    whose manifest carries a Merkle tree can instead be verified lazily,
+    one served chunk at a time.
+    """
+
+    def __init__(self, max_workers=None, chunk_size=HASH_CHUNK_SIZE):
+        self.max_workers = max_workers or min(8, os.cpu_count() or 1)
+        self.chunk_size = chunk_size
+        self._results = {}
+        self._verified_chunks = {}
+        self._locks = {}
+        self._guard = threading.Lock()
+        self._executor = None
+
+    def _fingerprint_lock(self, fingerprint):
+        with self._guard:
+            lock = self._locks.get(fingerprint)
+            if lock is None:
+                lock = self._locks[fingerprint] = threading.Lock()
+            return lock
+
+    def _get_executor(self):
+        with self._guard:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix='crate-verify')
+            return self._executor
+
+    def verify(self, crate_path, expected_hashes, fingerprint=None):
+        """Return True if every hashed member in the crate matches the manifest."""
+        if fingerprint is None:
+            fingerprint = crate_fingerprint(crate_path)
+        cached = self._results.get(fingerprint)
+        if cached is not None:
+            return cached
+
+        # Concurrent views of the same crate wait for one verification
+        with self._fingerprint_lock(fingerprint):
+            cached = self._results.get(fingerprint)
+            if cached is not None:
+                return cached
+            result = self._verify_members(crate_path, expected_hashes)
+            self._results[fingerprint] = result
+            return result
+
+    def _verify_members(self, crate_path, expected_hashes):
+        with zipfile.ZipFile(crate_path, 'r') as crate:
+            members = [info for info in crate.infolist() if info.filename in expected_hashes]
+
+        total_bytes = sum(info.file_size for info in members)
+        if (self.max_workers < 2 or len(members) < 2 or
+                (len(members) < PARALLEL_MIN_MEMBERS and total_bytes < PARALLEL_MIN_BYTES)):
+            for info in members:
+                if hash_member(crate_path, info, self.chunk_size) != expected_hashes[info.filename]:
+                    return False
+            return True
+
+        executor = self._get_executor()
+        # Largest members first so the pool isn't left waiting on one big file
+        members.sort(key=lambda info: info.file_size, reverse=True)
+        pending = {executor.submit(hash_member, crate_path, info, self.chunk_size): info
+                   for info in members}
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    info = pending.pop(future)
+                    if future.result() != expected_hashes[info.filename]:
+                        return False
+            return True
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def verify_range(self, crate_path, info, merkle, start, end, fingerprint):
+        """Verify the chunks of one member that cover bytes [start, end).
+
+        Chunks already checked for this crate fingerprint are skipped, so
+        each part of a resource is hashed at most once per process.
+        Members the Merkle tree doesn't list are not checked.
+        """
+        tree = merkle['files'].get(info.filename)
+        if tree is None:
+            return True
+        if tree['size'] != info.file_size:
+            return False
+        chunk_size = merkle['chunk_size']
+        first = start // chunk_size
+        last = max(first, (end - 1) // chunk_size)
+
+        with self._guard:
+            verified = self._verified_chunks.setdefault((fingerprint, info.filename), set())
+        needed = [index for index in range(first, last + 1) if index not in verified]
+        if not needed:
+            return True
+
+        with zipfile.ZipFile(crate_path, 'r') as crate:
+            with crate.open(info) as member:
+                member.seek(needed[0] * chunk_size)
+                for index in range(needed[0], needed[-1] + 1):
+                    data = member.read(chunk_size)
+                    if index in verified:
+                        continue
+                    if chunk_hash(data) != tree['chunks'][index]:
+                        return False
+                    verified.add(index)
+        return True
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from flask import Response
+
+# Bodies smaller than this aren't worth compressing
+GZIP_MIN_BYTES = 512
+
+# Bodies are compressed once and reused, so the slowest (smallest) level is fine
+GZIP_LEVEL = 9
+
+# Default upper bound for all cached bodies together
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+# Media types that compress well
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'application/xml',
+                      'application/x-yaml', 'image/svg+xml')
+
+
+def is_compressible(mimetype):
+    return bool(mimetype) and mimetype.startswith(COMPRESSIBLE_TYPES)
+
+
+def accepts_gzip(request):
+    return request.accept_encodings['gzip'] > 0
+
+
+class CachedBody:
+    """A response body with its strong ETag and, if it helps, a gzip copy made once."""
+
+    __slots__ = ('body', 'mimetype', 'etag', 'gzipped')
+
+    def __init__(self, body, mimetype, etag=None):
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = etag or hashlib.sha256(body).hexdigest()[:32]
+        self.gzipped = None
+        if is_compressible(mimetype) and len(body) >= GZIP_MIN_BYTES:
+            # mtime=0 keeps the compressed bytes identical for identical bodies
+            gzipped = gzip.compress(body, GZIP_LEVEL, mtime=0)
+            if len(gzipped) < len(body):
+                self.gzipped = gzipped
+
+    @property
+    def size(self):
+        return len(self.body) + len(self.gzipped or b'')
+
+
+class ResponseCache:
+    """Bounded LRU of response bodies, keyed by name and validated by a token.
+
+    ``validator`` captures whatever the body was built from (a file's
+    size and mtime, a manifest hash, the progress version...). A lookup
+    with a different validator is a miss, and storing the new body
+    replaces the old one, so stale entries never linger.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, validator):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != validator:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, validator, cached):
+        """Store ``cached`` (unless it alone exceeds the budget) and return it."""
+        if cached.size > self.max_bytes:
+            return cached
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1].size
+            self._entries[key] = (validator, cached)
+            self._bytes += cached.size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+        return cached
+
+    def get_or_build(self, key, validator, build, mimetype):
+        """The cached body for ``key``, calling ``build()`` (returning str or bytes) on a miss."""
+        cached = self.get(key, validator)
+        if cached is None:
+            body = build()
+            if isinstance(body, str):
+                body = body.encode('utf-8')
+            cached = self.put(key, validator, CachedBody(body, mimetype))
+        return cached
+
+
+def cached_response(request, cached, cache_control='no-cache', headers=None):
+    """Serve a cached body: 304 if the client's copy is current, else gzip if it is accepted.
+
+    The gzip copy is a separate representation, so it gets its own ETag.
+    """
+    use_gzip = cached.gzipped is not None and accepts_gzip(request)
+    etag = f'{cached.etag}-gz' if use_gzip else cached.etag
+    headers = dict(headers or {})
+    headers['ETag'] = f'"{etag}"'
+    headers['Cache-Control'] = cache_control
+    if cached.gzipped is not None:
+        headers['Vary'] = 'Accept-Encoding'
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+    if use_gzip:
+        headers['Content-Encoding'] = 'gzip'
+        return Response(cached.gzipped, mimetype=cached.mimetype, headers=headers)
+    return Response(cached.body, mimetype=cached.mimetype, headers=headers)
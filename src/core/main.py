@@ -1,78 +1,142 @@
 #!/usr/bin/env python3
+import time
+_process_started = time.perf_counter()
 import os
 import sys
+import argparse
+import threading
+import copy
 import json
 import zipfile
 import hashlib
 from pathlib import Path
-from flask import Flask, render_template, jsonify, request, send_from_directory, abort, send_file
-import yaml
-from tools.portable.h8mail.wrapper import H8mailWrapper
-from tools.portable.nmap.wrapper import NmapWrapper
-from tools.portable.theharvester.wrapper import TheHarvesterWrapper
+from flask import Flask, Response, render_template, jsonify, request, abort
 
 # Add the project root to the Python path
 project_root = Path(__file__).parent.parent.parent
 sys.path.append(str(project_root))
 
+from tools.portable.registry import ToolRegistry
+from tools.portable.history import DEFAULT_PAGE_SIZE
+from tools.portable.jobs import ScanJobManager, QueueFullError, CACHED, FINAL_STATES
+from tools.portable.scan_cache import scan_key
+from tools.portable.nmap.batch import parse_targets
+from tools.portable.storage import scratch_root, write_stats, process_bytes_written
+from tools.portable.logs import configure_logging, get_logger, lazy_json
+from src.core.crate_catalog import CrateCatalog
+from src.core.crate_verify import CrateVerifier, verify_manifest_tree
+from src.core.crate_resources import member_response
+from src.core.http_cache import ResponseCache, cached_response
+from src.utils.skill_sheet import ProgressStore, VALID_STATUSES
+from src.core.task_validation import TaskValidator, ValidationError, ToolNotReadyError
+from src.core.startup import StartupTimer
+
+startup_timer = StartupTimer(_process_started)
+
+# One logging setup for the whole process; CYBERCRATE_LOG_LEVEL(S) pick the levels
+configure_logging(project_root / 'data' / 'logs' / 'cybercrate.log')
+logger = get_logger('web')
+startup_timer.mark('imports')
+
 # Creates a flask app
 app = Flask(__name__, 
            template_folder=str(project_root / 'templates'),
            static_folder=str(project_root / 'static'))
 
-# Initialize h8mail wrapper
-h8mail_wrapper = H8mailWrapper()
-nmap_wrapper = NmapWrapper()
-theharvester_wrapper = TheHarvesterWrapper()
+# Tool wrappers are imported and created the first time a route needs them
+tools = ToolRegistry()
+tools.register('h8mail', 'tools.portable.h8mail.wrapper:H8mailWrapper')
+tools.register('nmap', 'tools.portable.nmap.wrapper:NmapWrapper')
+tools.register('theharvester', 'tools.portable.theharvester.wrapper:TheHarvesterWrapper')
+
+# Scans run as background jobs on a bounded pool; each tool has its own concurrency limit
+scan_jobs = ScanJobManager(
+    max_workers=int(os.environ.get('CYBERCRATE_SCAN_WORKERS', '4')),
+    max_queued=int(os.environ.get('CYBERCRATE_SCAN_QUEUE', '32')),
+    tool_limits={'nmap': 2, 'h8mail': 1, 'theharvester': 1,
+                 'validation': int(os.environ.get('CYBERCRATE_VALIDATION_WORKERS', '2'))},
+    default_timeout=int(os.environ.get('CYBERCRATE_SCAN_TIMEOUT', '900')),
+    # Identical successful scans are reused for this long (0 disables the cache)
+    result_ttl=int(os.environ.get('CYBERCRATE_SCAN_CACHE_TTL', '300'))
+)
+
+# Parsed crate manifests, refreshed incrementally as .crate files change
+crate_catalog = CrateCatalog(project_root / 'modules' / 'crates')
+
+# Task progress, stored per task in SQLite (progress.yaml is imported once)
+PROGRESS_DIR = project_root / 'data' / 'progress'
+progress_store = ProgressStore(PROGRESS_DIR / 'progress.sqlite', PROGRESS_DIR / 'progress.yaml',
+                               write_stats=write_stats)
+
+# Integrity results per crate fingerprint, so an unchanged crate is verified once per boot
+crate_verifier = CrateVerifier()
+
+#Task checks run the tools from their provisioned environments
+#This runs on the request thread, so it never installs anything itself: a tool that
+#isn't ready yet is installed in the background and the check is refused for now
+def resolve_validation_command(argv):
+    name = argv[0].lower() if argv else None
+    if name not in PROVISIONED_TOOLS:
+        return argv
+    provisioner = tools.get(name).provisioner
+    if not provisioner.is_ready():
+        provisioner.warmup()
+        raise ToolNotReadyError(f"{name} is still being installed, try again shortly")
+    if name == 'theharvester':
+        return [str(provisioner.executable('theHarvester'))] + argv[1:]
+    return [str(provisioner.python), '-m', 'h8mail'] + argv[1:]
+
+#A passed check marks the task completed, which also notifies /progress/stream listeners
+def mark_task_completed(module_name, task_id):
+    progress_store.set_task_status(module_name, task_id, 'completed')
+
+task_validator = TaskValidator(scan_jobs, resolve_command=resolve_validation_command,
+                               on_passed=mark_task_completed)
+
+# Tools installed into their own virtualenvs by their provisioners
+PROVISIONED_TOOLS = ('h8mail', 'theharvester')
+
+startup_timer.mark('shared state')
+
+# Rendered pages and precompressed text, revalidated with ETags instead of being resent
+response_cache = ResponseCache(int(os.environ.get('CYBERCRATE_RESPONSE_CACHE_MB', '32')) * 1024 * 1024)
 
 #Key element, this creates a module box object that contains the manifest and content of a module
 #The manifest is the metadata of the module, and the content is the files of the module
 class ModuleBox:
-    def __init__(self, crate_path):
+    def __init__(self, crate_path, manifest=None, content_hash=None):
         self.crate_path = crate_path
-        self.manifest = None
-        self.content_path = None
+        self.manifest = manifest
+        self.content_hash = content_hash
         self.load_manifest()
 
     #This function loads the manifest from the crate
+    #A manifest already parsed by the crate catalog is reused instead of re-read
     def load_manifest(self):
-        print(f"Loading manifest from {self.crate_path}")
+        if self.manifest is not None and self.content_hash is not None:
+            return
+        logger.debug("Loading manifest from %s", self.crate_path)
         with zipfile.ZipFile(self.crate_path, 'r') as crate:
             manifest_data = crate.read('manifest.json')
+        if self.manifest is None:
             self.manifest = json.loads(manifest_data)
-            print(f"Loaded manifest: {json.dumps(self.manifest, indent=2)}")
-            
-            # Extract content to temporary directory
-            temp_dir = project_root / 'data' / 'temp_content'
-            temp_dir.mkdir(exist_ok=True)
-            crate.extractall(temp_dir)
-            self.content_path = temp_dir
+            logger.debug("Loaded manifest: %s", lazy_json(self.manifest, indent=2))
+        if self.content_hash is None:
+            self.content_hash = hashlib.sha256(manifest_data).hexdigest()
 
+    #Hashes are streamed (in parallel for large crates) and remembered per crate version
+    #Crates built with a Merkle tree only have their manifest checked here; each
+    #resource is then verified when it is served (see serve_module_resource)
     def verify_integrity(self):
-        with zipfile.ZipFile(self.crate_path, 'r') as crate:
-            for file_info in crate.infolist():
-                if file_info.filename in self.manifest['hashes']:
-                    data = crate.read(file_info.filename)
-                    file_hash = hashlib.sha256(data).hexdigest()
-                    if file_hash != self.manifest['hashes'][file_info.filename]:
-                        return False
-        return True
+        if 'merkle' in self.manifest:
+            return verify_manifest_tree(self.manifest)
+        return crate_verifier.verify(self.crate_path, self.manifest['hashes'])
 
 def load_progress():
-    progress_file = project_root / 'data' / 'progress' / 'progress.yaml'
     try:
-        if progress_file.exists():
-            with open(progress_file, 'r') as f:
-                data = yaml.safe_load(f)
-                print(f"Loaded progress data: {json.dumps(data, indent=2)}")
-                # Ensure the data structure is correct
-                if not isinstance(data, dict):
-                    data = {'modules': {}}
-                if 'modules' not in data:
-                    data['modules'] = {}
-                return data
+        return progress_store.load()
     except Exception as e:
-        print(f"Error loading progress: {str(e)}")
+        logger.error("Error loading progress: %s", e)
     return {'modules': {}}
 
 def save_progress(progress):
@@ -82,69 +146,65 @@ def save_progress(progress):
             progress = {'modules': {}}
         if 'modules' not in progress:
             progress['modules'] = {}
-            
-        print(f"Saving progress data: {json.dumps(progress, indent=2)}")
-        progress_file = project_root / 'data' / 'progress' / 'progress.yaml'
-        with open(progress_file, 'w') as f:
-            yaml.dump(progress, f, default_flow_style=False)
+        progress_store.save(progress)
     except Exception as e:
-        print(f"Error saving progress: {str(e)}")
+        logger.error("Error saving progress: %s", e)
         raise
 
+TEMPLATES_DIR = project_root / 'templates'
+_templates_version = None
+
+#Templates only change on disk during development, so production checks them once
+def templates_version():
+    global _templates_version
+    if _templates_version is None or app.debug:
+        _templates_version = max((f.stat().st_mtime_ns for f in TEMPLATES_DIR.glob('*.html')), default=0)
+    return _templates_version
+
+#Pages are rendered once per validator (the data they show) and answered with 304
+#or a precompressed copy afterwards; ``render`` is only called on a miss
+def cached_page(key, validator, render):
+    cached = response_cache.get_or_build(key, (validator, templates_version()), render, 'text/html')
+    return cached_response(request, cached)
+
 #This route is used to view the index page
 @app.route('/')
 def index():
-    print("Index route accessed")
-    crates_dir = project_root / 'modules' / 'crates'
-    crates = []
-    for crate_file in crates_dir.glob('*.crate'):
-        try:
-            with zipfile.ZipFile(crate_file, 'r') as crate:
-                manifest_data = crate.read('manifest.json')
-                manifest = json.loads(manifest_data)
-                display_name = manifest.get('name', crate_file.stem)
-                url_name = display_name.replace(' ', '_')
-                num_tasks = len(manifest.get('tasks', []))
-                crates.append({
-                    'filename': crate_file.name,
-                    'display_name': display_name,
-                    'url_name': url_name,
-                    'num_tasks': num_tasks
-                })
-        except Exception as e:
-            print(f"Error reading manifest from {crate_file}: {e}")
-    print(f"Found crates: {crates}")
-    progress = load_progress()
-    return render_template('index.html', crates=crates, progress=progress)
+    entries = crate_catalog.entries()
+
+    def render():
+        crates = [entry.summary() for entry in entries]
+        logger.debug("Found crates: %s", lazy_json(crates))
+        return render_template('index.html', crates=crates, progress=load_progress())
+    return cached_page('index', (tuple(entry.manifest_hash for entry in entries), progress_store.version), render)
 
 #This route is used to view a module
 @app.route('/module/<url_name>')
 def view_module(url_name):
-    print(f"Viewing module: {url_name}")
-    crates_dir = project_root / 'modules' / 'crates'
+    logger.debug("Viewing module: %s", url_name)
     # Find the crate whose manifest name matches url_name (spaces replaced with underscores)
-    for crate_file in crates_dir.glob('*.crate'):
-        with zipfile.ZipFile(crate_file, 'r') as crate:
-            manifest_data = crate.read('manifest.json')
-            manifest = json.loads(manifest_data)
-            display_name = manifest.get('name', crate_file.stem)
-            if display_name.replace(' ', '_') == url_name:
-                # Found the correct crate
-                if not ModuleBox(crate_file).verify_integrity():
-                    print("Module integrity check failed")
-                    return "Module integrity check failed", 400
-                module = ModuleBox(crate_file)
-                progress = load_progress()
-                module_progress = progress.get('modules', {}).get(display_name, {}).get('tasks', {})
-                for task in module.manifest['tasks']:
-                    task_id = task['id']
-                    task['status'] = module_progress.get(task_id, 'pending')
-                return render_template('module.html', 
-                                      module=module.manifest,
-                                      content_path=module.content_path,
-                                      progress=progress)
-    print(f"Crate not found for url_name: {url_name}")
-    return "Module not found", 404
+    entry = crate_catalog.get(url_name)
+    if entry is None:
+        logger.warning("Crate not found for url_name: %s", url_name)
+        return "Module not found", 404
+    display_name = entry.display_name
+    # The task statuses below are per request, so work on a copy of the cached manifest
+    module = ModuleBox(entry.path, manifest=copy.deepcopy(entry.manifest),
+                       content_hash=entry.manifest_hash)
+    if not module.verify_integrity():
+        logger.warning("Module integrity check failed: %s", url_name)
+        return "Module integrity check failed", 400
+
+    def render():
+        progress = load_progress()
+        module_progress = progress.get('modules', {}).get(display_name, {}).get('tasks', {})
+        for task in module.manifest['tasks']:
+            task_id = task['id']
+            task['status'] = module_progress.get(task_id, 'pending')
+        return render_template('module.html',
+                              module=module.manifest,
+                              progress=progress)
+    return cached_page(('module', url_name), (entry.fingerprint, entry.manifest_hash, progress_store.version), render)
 
 #This route is used to handle the progress of the module
 @app.route('/progress', methods=['GET', 'POST'])
@@ -152,39 +212,114 @@ def handle_progress():
     if request.method == 'POST':
         try:
             incoming_progress = request.json
-            print(f"Received progress update: {json.dumps(incoming_progress, indent=2)}")
+            logger.debug("Received progress update: %s", lazy_json(incoming_progress, indent=2))
             
             # Validate the progress data structure
             if not isinstance(incoming_progress, dict):
                 raise ValueError("Progress data must be a dictionary")
             if 'modules' not in incoming_progress:
                 incoming_progress['modules'] = {}
+            if not isinstance(incoming_progress['modules'], dict):
+                raise ValueError("Progress modules must be a dictionary")
             
-            # Load existing progress
-            existing_progress = load_progress()
-            if 'modules' not in existing_progress:
-                existing_progress['modules'] = {}
-            
-            # Merge: update only the modules present in the incoming progress
-            for module_name, module_data in incoming_progress['modules'].items():
-                existing_progress['modules'][module_name] = module_data
-            
-            # Ensure all task statuses are valid
-            for module_name, module_data in existing_progress['modules'].items():
-                if 'tasks' in module_data:
-                    for task_id, status in module_data['tasks'].items():
-                        if status not in ['completed', 'pending']:
-                            module_data['tasks'][task_id] = 'pending'
-            
-            save_progress(existing_progress)
-            return jsonify({'status': 'success', 'progress': existing_progress})
+            # Merge: update only the modules present in the incoming progress.
+            # The store does this in one transaction, invalid statuses become pending.
+            version, existing_progress = progress_store.merge(incoming_progress['modules'])
+            return jsonify({'status': 'success', 'progress': existing_progress, 'version': version})
         except Exception as e:
-            print(f"Error saving progress: {str(e)}")
+            logger.error("Error saving progress: %s", e)
             return jsonify({'status': 'error', 'message': str(e)}), 500
     
-    progress = load_progress()
-    print(f"Returning progress: {json.dumps(progress, indent=2)}")
-    return jsonify(progress)
+    # Polls that already have the current version get a 304 without touching the store
+    etag = f'progress-{progress_store.version}'
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers={'ETag': f'"{etag}"', 'Cache-Control': 'no-cache'})
+    version, body = progress_json()
+    return Response(body, mimetype='application/json',
+                    headers={'ETag': f'"progress-{version}"', 'Cache-Control': 'no-cache'})
+
+#Serialized progress, reused until the progress version changes
+_progress_json = (None, None)
+
+def progress_json():
+    global _progress_json
+    version, progress = progress_store.snapshot()
+    cached_version, body = _progress_json
+    if cached_version != version:
+        body = json.dumps(progress)
+        _progress_json = (version, body)
+    return version, body
+
+#Seconds between keep-alive comments on an idle progress stream
+PROGRESS_STREAM_KEEPALIVE = 25
+#A stream is closed after this long so it doesn't hold a server thread forever;
+#the browser reconnects after PROGRESS_STREAM_RETRY ms, resuming from Last-Event-ID
+PROGRESS_STREAM_MAX_SECONDS = int(os.environ.get('CYBERCRATE_PROGRESS_STREAM_SECONDS', '60'))
+PROGRESS_STREAM_RETRY = 3000
+
+#This route pushes the progress document to the browser every time a change is committed
+@app.route('/progress/stream')
+def progress_stream():
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    last_version = int(last_event_id) if last_event_id.isdigit() else None
+
+    def generate():
+        version = last_version
+        deadline = time.monotonic() + PROGRESS_STREAM_MAX_SECONDS
+        yield f'retry: {PROGRESS_STREAM_RETRY}\n\n'
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            current = progress_store.wait_for_change(version, timeout=min(PROGRESS_STREAM_KEEPALIVE, remaining))
+            if current == version:
+                yield ': keep-alive\n\n'
+                continue
+            version, body = progress_json()
+            yield f'id: {version}\nevent: progress\ndata: {body}\n\n'
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+#This route updates the status of a single task
+@app.route('/progress/<module_name>/<task_id>', methods=['PATCH'])
+def update_task_progress(module_name, task_id):
+    data = request.get_json(silent=True) or {}
+    status = data.get('status')
+    if status not in VALID_STATUSES:
+        return jsonify({'status': 'error',
+                        'message': f"Status must be one of: {', '.join(VALID_STATUSES)}"}), 400
+    try:
+        version = progress_store.set_task_status(module_name, task_id, status)
+    except Exception as e:
+        logger.error("Error saving progress: %s", e)
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+    return jsonify({'status': 'success', 'module': module_name, 'task_id': task_id,
+                    'task_status': status, 'version': version})
+
+@app.route('/module/<url_name>/tasks/<task_id>/validate', methods=['POST'])
+def validate_task(url_name, task_id):
+    """Run a task's automatic check as a job; a pass marks the task completed"""
+    entry = crate_catalog.get(url_name)
+    if entry is None:
+        return jsonify({'success': False, 'error': 'Module not found'}), 404
+    data = request.get_json(silent=True) or {}
+    try:
+        job, source = task_validator.validate(entry, task_id, inputs=data.get('inputs'),
+                                              refresh=bool(data.get('no_cache')))
+        return scan_job_response(job, source)
+    except ToolNotReadyError as e:
+        return jsonify({'success': False, 'error': str(e)}), 503, {'Retry-After': '30'}
+    except ValidationError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except QueueFullError as e:
+        return jsonify({'success': False, 'error': str(e)}), 429
+
+@app.route('/progress/export')
+def export_progress():
+    """Download the progress as YAML"""
+    return Response(progress_store.export_yaml(), mimetype='application/x-yaml',
+                    headers={'Content-Disposition': 'attachment; filename=progress.yaml'})
 
 CHEATSHEETS_DIR = project_root / 'cheatsheets'
 
@@ -194,26 +329,100 @@ def cheatsheets_list():
     if CHEATSHEETS_DIR.exists():
         for f in CHEATSHEETS_DIR.glob('*.md'):
             cheatsheets.append(f.stem)
-    return render_template('cheatsheets.html', cheatsheets=cheatsheets)
+    return cached_page('cheatsheets', tuple(cheatsheets),
+                       lambda: render_template('cheatsheets.html', cheatsheets=cheatsheets))
 
+#The markdown is only read again when the file changes on disk
 @app.route('/cheatsheet/<name>')
 def cheatsheet_view(name):
     cheatsheet_file = CHEATSHEETS_DIR / f'{name}.md'
-    if not cheatsheet_file.exists():
+    try:
+        stat = cheatsheet_file.stat()
+    except OSError:
         abort(404)
-    with open(cheatsheet_file, 'r') as f:
-        content = f.read()
-    return render_template('cheatsheet_view.html', name=name, content=content)
+
+    def render():
+        with open(cheatsheet_file, 'r') as f:
+            content = f.read()
+        return render_template('cheatsheet_view.html', name=name, content=content)
+    return cached_page(('cheatsheet', name), (stat.st_size, stat.st_mtime_ns), render)
 
 @app.route('/tools')
 def tools_list():
     """List all available tools"""
-    return render_template('tools.html')
+    return cached_page('tools', (), lambda: render_template('tools.html'))
+
+def scan_job_response(job, source):
+    """Response for a submitted scan.
+
+    ``source`` says whether the job is new, an identical scan already in
+    flight, or a cached result; a cached result comes back with 200 and
+    ``scanned_at``, the time the original scan finished.
+    """
+    data = {'success': True, 'source': source, 'cached': source == CACHED, **job.to_dict()}
+    if source == CACHED:
+        data['scanned_at'] = job.finished_at
+        return jsonify(data), 200
+    return jsonify(data), 202
+
+def history_response(wrapper):
+    """One page of a tool's scan history.
+
+    Query parameters: limit, cursor (the previous page's next_cursor),
+    target, status, since and until (scan_date bounds, inclusive).
+    """
+    try:
+        scans, next_cursor = wrapper.history.query(
+            limit=request.args.get('limit', DEFAULT_PAGE_SIZE, type=int),
+            cursor=request.args.get('cursor'),
+            target=request.args.get('target'),
+            status=request.args.get('status'),
+            since=request.args.get('since'),
+            until=request.args.get('until')
+        )
+        return jsonify({'scans': scans, 'next_cursor': next_cursor})
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+def scan_output_response(wrapper, scan_id):
+    """The full stored output of one scan, decompressed on request"""
+    try:
+        output = wrapper.history.output(scan_id)
+        if output is None:
+            return jsonify({
+                'success': False,
+                'error': 'Scan not found'
+            }), 404
+        return jsonify({'scan_id': scan_id, **output})
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+def latest_scan_response(wrapper, target):
+    """The most recent scan of a target"""
+    try:
+        scan = wrapper.history.latest(target)
+        if not scan:
+            return jsonify({
+                'success': False,
+                'error': 'No results found for this target'
+            }), 404
+        return jsonify(scan)
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
 
 @app.route('/tool/h8mail')
 def h8mail_interface():
     """H8mail tool interface"""
-    return render_template('tool_h8mail.html')
+    return cached_page('tool_h8mail', (), lambda: render_template('tool_h8mail.html'))
 
 @app.route('/tool/h8mail/scan', methods=['POST'])
 def h8mail_scan():
@@ -228,10 +437,13 @@ def h8mail_scan():
                 'error': 'Target is required'
             }), 400
 
-        # Run the scan
-        result = h8mail_wrapper.run_scan(target, options=options)
-        
-        return jsonify(result)
+        # Queue the scan (or join/reuse an identical one) and hand back its job ID straight away
+        job, source = scan_jobs.submit_shared(
+            'h8mail', tools.get('h8mail').run_scan, target, options=options,
+            cache_key=scan_key('h8mail', target, options), refresh=bool(data.get('no_cache')))
+        return scan_job_response(job, source)
+    except QueueFullError as e:
+        return jsonify({'success': False, 'error': str(e)}), 429
     except Exception as e:
         return jsonify({
             'success': False,
@@ -240,42 +452,20 @@ def h8mail_scan():
 
 @app.route('/tool/h8mail/history')
 def h8mail_history():
-    try:
-        history = h8mail_wrapper.get_scan_history()
-        return jsonify(history)
-    except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 400
+    return history_response(tools.get('h8mail'))
 
-@app.route('/tool/h8mail/results/<target>')
+@app.route('/tool/h8mail/history/<int:scan_id>/output')
+def h8mail_scan_output(scan_id):
+    return scan_output_response(tools.get('h8mail'), scan_id)
+
+@app.route('/tool/h8mail/results/<path:target>')
 def h8mail_results(target):
-    try:
-        # Get the most recent scan results for the target
-        history = h8mail_wrapper.get_scan_history()
-        target_results = next(
-            (scan for scan in history if scan['target'] == target),
-            None
-        )
-        
-        if not target_results:
-            return jsonify({
-                'success': False,
-                'error': 'No results found for this target'
-            }), 404
-            
-        return jsonify(target_results)
-    except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 400
+    return latest_scan_response(tools.get('h8mail'), target)
 
 @app.route('/tool/nmap')
 def nmap_interface():
     """Nmap tool interface"""
-    return render_template('tool_nmap.html')
+    return cached_page('tool_nmap', (), lambda: render_template('tool_nmap.html'))
 
 @app.route('/tool/nmap/scan', methods=['POST'])
 def nmap_scan():
@@ -285,107 +475,281 @@ def nmap_scan():
         options = data.get('options', [])
         if not target:
             return jsonify({'success': False, 'error': 'Target is required'}), 400
-        result = nmap_wrapper.run_scan(target, options=options)
-        return jsonify(result)
+        job, source = scan_jobs.submit_shared(
+            'nmap', tools.get('nmap').run_scan, target, options=options,
+            cache_key=scan_key('nmap', target, options), refresh=bool(data.get('no_cache')))
+        return scan_job_response(job, source)
+    except QueueFullError as e:
+        return jsonify({'success': False, 'error': str(e)}), 429
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
-@app.route('/tool/nmap/history')
-def nmap_history():
+@app.route('/tool/nmap/batch', methods=['POST'])
+def nmap_batch_scan():
+    """Scan a list of targets/CIDRs (and/or the text of a target file) as parallel shards"""
     try:
-        history = nmap_wrapper.get_scan_history()
-        return jsonify(history)
+        data = request.json
+        targets = data.get('targets') or []
+        if isinstance(targets, str):
+            targets = parse_targets(targets)
+        if data.get('targets_file'):
+            targets = list(targets) + parse_targets(data['targets_file'])
+        options = data.get('options', [])
+        if not targets:
+            return jsonify({'success': False, 'error': 'Targets are required'}), 400
+        max_shards = data.get('max_shards')
+        if max_shards is not None and (isinstance(max_shards, bool) or not isinstance(max_shards, int)):
+            return jsonify({'success': False, 'error': 'max_shards must be an integer'}), 400
+        job, source = scan_jobs.submit_shared(
+            'nmap', tools.get('nmap').run_batch_scan, targets, options=options, max_shards=max_shards,
+            cache_key=scan_key('nmap-batch', ' '.join(sorted(set(targets))), options),
+            refresh=bool(data.get('no_cache')))
+        return scan_job_response(job, source)
+    except QueueFullError as e:
+        return jsonify({'success': False, 'error': str(e)}), 429
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
+@app.route('/tool/nmap/history')
+def nmap_history():
+    return history_response(tools.get('nmap'))
+
+@app.route('/tool/nmap/history/<int:scan_id>/output')
+def nmap_scan_output(scan_id):
+    return scan_output_response(tools.get('nmap'), scan_id)
+
+@app.route('/tool/nmap/results/<path:target>')
+def nmap_results(target):
+    return latest_scan_response(tools.get('nmap'), target)
+
+@app.route('/tool/nmap/hosts')
+def nmap_hosts():
+    """Hosts seen with a given port/state, e.g. ?port=22&state=open"""
+    port = request.args.get('port', type=int)
+    if port is None:
+        return jsonify({'success': False, 'error': 'port is required'}), 400
+    hosts = tools.get('nmap').find_hosts(
+        port,
+        state=request.args.get('state', 'open'),
+        protocol=request.args.get('protocol', 'tcp'),
+        service=request.args.get('service'),
+        limit=request.args.get('limit', 100, type=int)
+    )
+    return jsonify(hosts)
+
+@app.route('/tool/nmap/services/<path:target>')
+def nmap_services(target):
+    """Open services seen on a target across all stored scans"""
+    return jsonify(tools.get('nmap').get_services(target))
+
 @app.route('/module_resource/<module_name>/<path:resource_path>')
 def serve_module_resource(module_name, resource_path):
     # Find the crate whose manifest name matches module_name
-    crates_dir = project_root / 'modules' / 'crates'
-    for crate_file in crates_dir.glob('*.crate'):
-        with zipfile.ZipFile(crate_file, 'r') as crate:
-            manifest_data = crate.read('manifest.json')
-            manifest = json.loads(manifest_data)
-            display_name = manifest.get('name', crate_file.stem)
-            if display_name.replace(' ', '_') == module_name:
-                # Extract content to temp dir if not already
-                temp_dir = project_root / 'data' / 'temp_content' / module_name
-                temp_dir.mkdir(parents=True, exist_ok=True)
-                crate.extractall(temp_dir)
-                file_path = temp_dir / resource_path
-                if file_path.exists():
-                    return send_file(file_path)
-                else:
-                    return f"Resource not found: {resource_path}", 404
-    return "Module not found", 404
+    entry = crate_catalog.get(module_name)
+    if entry is None:
+        return "Module not found", 404
+    # Stream the member straight out of the crate instead of extracting it
+    info = entry.members.get(resource_path)
+    if info is None or info.is_dir():
+        return f"Resource not found: {resource_path}", 404
+    merkle = entry.manifest.get('merkle')
+    if merkle is None:
+        return member_response(entry, info, request, cache=response_cache)
+
+    # Lazily verify just the chunks this response will send
+    def verify(start, end):
+        return crate_verifier.verify_range(entry.path, info, merkle, start, end, entry.fingerprint)
+    return member_response(entry, info, request, verify=verify, cache=response_cache)
 
 @app.route('/tool/theharvester')
 def theharvester_interface():
     """TheHarvester tool interface"""
-    return render_template('tool_theharvester.html')
+    return cached_page('tool_theharvester', (), lambda: render_template('tool_theharvester.html'))
 
 @app.route('/tools/theharvester/scan', methods=['POST'])
 def theharvester_scan():
     try:
-        print("[FLASK DEBUG] Received POST to /tools/theharvester/scan")
         data = request.get_json()
-        print(f"[FLASK DEBUG] Raw request data: {repr(data)}")
+        logger.debug("theHarvester scan request: %r", data)
         target = data.get('target')
         sources = data.get('sources', 'all')
+        # Options may be sent at the top level or nested under 'options'
+        nested = data.get('options') or {}
         options = {
-            'limit': data.get('limit', 50),
-            'verbose': data.get('verbose', False),
-            'output': data.get('output', None)
+            'limit': nested.get('limit', data.get('limit', 50)),
+            'verbose': nested.get('verbose', data.get('verbose', False)),
+            'output': nested.get('output', data.get('output', None))
         }
-        print(f"[FLASK DEBUG] target: {repr(target)}")
-        print(f"[FLASK DEBUG] sources: {repr(sources)}")
-        print(f"[FLASK DEBUG] options: {repr(options)}")
-        
+        logger.debug("target: %r, sources: %r, options: %r", target, sources, options)
+
         if not target:
-            print("[FLASK DEBUG] No target provided!")
             return jsonify({'error': 'Target domain is required'}), 400
             
-        wrapper = TheHarvesterWrapper()
-        result = wrapper.run_scan(target, sources, options)
-        
-        if not result['success']:
-            error_message = result.get('stderr', '') or result.get('error', 'Unknown error')
-            print(f"[FLASK DEBUG] Scan failed: {error_message}")
-            return jsonify({
-                'error': f"Scan failed: {error_message}",
-                'command': result.get('command', ''),
-                'details': result
-            }), 500
-            
-        print("[FLASK DEBUG] Scan succeeded!")
-        return jsonify({
-            'success': True,
-            'results': result['stdout'],
-            'command': result.get('command', '')
-        })
+        job, source = scan_jobs.submit_shared(
+            'theharvester', tools.get('theharvester').run_scan, target, sources, options,
+            cache_key=scan_key('theharvester', target, sources, options),
+            refresh=bool(data.get('no_cache')))
+        logger.debug("Scan job %s (%s)", job.id, source)
+        return scan_job_response(job, source)
+    except QueueFullError as e:
+        return jsonify({'error': str(e)}), 429
     except Exception as e:
-        print(f"[FLASK DEBUG] Exception: {str(e)}")
+        logger.exception("theHarvester scan request failed: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/tool/theharvester/history')
 def theharvester_history():
+    return history_response(tools.get('theharvester'))
+
+@app.route('/tool/theharvester/history/<int:scan_id>/output')
+def theharvester_scan_output(scan_id):
+    return scan_output_response(tools.get('theharvester'), scan_id)
+
+@app.route('/tool/theharvester/results/<path:target>')
+def theharvester_results(target):
+    return latest_scan_response(tools.get('theharvester'), target)
+
+@app.route('/tools/status')
+def tools_status():
+    """Whether each Python-based tool has been provisioned"""
+    return jsonify([tools.get(name).provisioner.status() for name in PROVISIONED_TOOLS])
+
+@app.route('/system/io')
+def io_status():
+    """Where scratch data goes and how much each subsystem has written to disk"""
+    scratch, ram_backed = scratch_root()
+    return jsonify({
+        'scratch_dir': str(scratch),
+        'scratch_in_memory': ram_backed,
+        'measured': write_stats.measured,
+        'subsystems': write_stats.snapshot(),
+        'process_bytes_written': process_bytes_written()
+    })
+
+#These routes expose the background scan jobs
+JOB_STREAM_KEEPALIVE = 15
+
+@app.route('/jobs')
+def list_jobs():
+    jobs = scan_jobs.list(tool=request.args.get('tool'))
+    return jsonify([job.to_dict(include_result=False) for job in jobs])
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = scan_jobs.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+#This route streams a job's output lines as server-sent events while it runs
+@app.route('/jobs/<job_id>/stream')
+def job_stream(job_id):
+    job = scan_jobs.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    after_seq = int(last_event_id) if last_event_id.isdigit() else 0
+
+    def generate():
+        seq = after_seq
+        while True:
+            lines, finished = job.read_output(seq, timeout=JOB_STREAM_KEEPALIVE)
+            if lines and lines[0][0] > seq + 1:
+                yield f'event: skipped\ndata: {lines[0][0] - seq - 1}\n\n'
+            for seq, stream, line in lines:
+                yield f'id: {seq}\nevent: output\ndata: {json.dumps({"stream": stream, "line": line})}\n\n'
+            if finished:
+                yield f'event: done\ndata: {json.dumps(job.to_dict(include_result=False))}\n\n'
+                return
+            if not lines:
+                yield ': keep-alive\n\n'
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    job = scan_jobs.cancel(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    data = job.to_dict(include_result=False)
+    # A scan shared with other callers keeps running for them
+    data['detached'] = job.status not in FINAL_STATES and not job.cancel_requested
+    return jsonify(data)
+
+#The first response is timed once, so the startup report includes time to first page
+@app.after_request
+def record_first_response(response):
+    if startup_timer.first_request_served():
+        get_logger('startup').info("First page served %.1f ms after launch", startup_timer.first_request * 1000)
+    return response
+
+#Provisioning runs in its own thread so importing the wrappers doesn't delay the server
+def warmup_tools():
+    def run():
+        for name in PROVISIONED_TOOLS:
+            tools.get(name).provisioner.warmup()
+    threading.Thread(target=run, name='tool-warmup', daemon=True).start()
+
+#Production serving: several requests at once, so open progress/job streams and
+#long scans don't hold up other tabs. Each open stream keeps one thread busy.
+SERVER_THREADS = int(os.environ.get('CYBERCRATE_THREADS', '16'))
+#Seconds a connection may sit idle (streams send keep-alives well within this)
+REQUEST_TIMEOUT = int(os.environ.get('CYBERCRATE_REQUEST_TIMEOUT', '120'))
+
+def serve_production(host, port, threads=SERVER_THREADS, timeout=REQUEST_TIMEOUT):
+    """Serve with waitress (pure Python, shipped in the USB wheelhouse), or Flask's threaded server without it"""
     try:
-        history = theharvester_wrapper.get_scan_history()
-        return jsonify(history)
-    except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 400
+        from waitress import serve
+    except ImportError:
+        serve = None
+    if serve is not None:
+        logger.info("Serving on http://%s:%s with waitress (%d threads)", host, port, threads)
+        serve(app, host=host, port=port, threads=threads, channel_timeout=timeout,
+              connection_limit=max(100, threads * 4), ident='CyberCrate')
+        return
+
+    from werkzeug.serving import WSGIRequestHandler
+
+    class TimeoutRequestHandler(WSGIRequestHandler):
+        pass
+    # Applied to each connection's socket by socketserver
+    TimeoutRequestHandler.timeout = timeout
+
+    logger.warning("waitress is not installed, using Flask's threaded server")
+    app.run(host=host, port=port, debug=False, use_reloader=False, threaded=True,
+            request_handler=TimeoutRequestHandler)
 
 #This is the main function that runs the web server
 def main():
+    parser = argparse.ArgumentParser(description='CyberCrate web interface')
+    parser.add_argument('--production', action='store_true',
+                        default=os.environ.get('CYBERCRATE_MODE') == 'production',
+                        help='run without the debugger and auto-reloader (used by the USB launcher)')
+    parser.add_argument('--host', default=os.environ.get('CYBERCRATE_HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('CYBERCRATE_PORT', '8080')))
+    parser.add_argument('--threads', type=int, default=SERVER_THREADS,
+                        help='worker threads in production mode')
+    parser.add_argument('--timeout', type=int, default=REQUEST_TIMEOUT,
+                        help='seconds an idle connection is kept in production mode')
+    args = parser.parse_args()
+
     # Ensure we're running from the correct directory
     if not (project_root / 'templates').exists():
         print("Error: Must run from the CyberCrate project root")
         sys.exit(1)
+    # Install h8mail and theHarvester in the background so the first scan doesn't
+    # wait for pip (only in the serving process, not the debug reloader's parent)
+    if args.production or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        warmup_tools()
+    startup_timer.mark('launch')
+    get_logger('startup').info(startup_timer.report())
     #This starts the web server
-    app.run(host='127.0.0.1', port=8080, debug=True)
+    if args.production:
+        # A single process: no reloader re-importing everything, no debugger
+        serve_production(args.host, args.port, threads=args.threads, timeout=args.timeout)
+    else:
+        app.run(host=args.host, port=args.port, debug=True)
 
 if __name__ == '__main__':
     main()
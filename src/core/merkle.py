@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+import hashlib
+
+# Files are split into chunks of this size; each chunk is a Merkle leaf
+MERKLE_CHUNK_SIZE = 1024 * 1024
+
+# Prefixes keep leaf and interior hashes from being confused for each other
+_LEAF = b'\x00'
+_NODE = b'\x01'
+
+
+def chunk_hash(data):
+    """Leaf hash of one file chunk."""
+    return hashlib.sha256(_LEAF + data).hexdigest()
+
+
+def file_leaf(path, file_root):
+    """Leaf hash binding a file's path to its chunk tree root."""
+    return hashlib.sha256(_LEAF + path.encode('utf-8') + b'\x00' + bytes.fromhex(file_root)).hexdigest()
+
+
+def merkle_root(leaves):
+    """Root of a binary Merkle tree over hex leaf hashes (odd nodes are promoted)."""
+    level = [bytes.fromhex(leaf) for leaf in leaves]
+    if not level:
+        return hashlib.sha256(_LEAF).hexdigest()
+    while len(level) > 1:
+        next_level = []
+        for i in range(0, len(level) - 1, 2):
+            next_level.append(hashlib.sha256(_NODE + level[i] + level[i + 1]).digest())
+        if len(level) % 2:
+            next_level.append(level[-1])
+        level = next_level
+    return level[0].hex()
+
+
+def crate_root(files):
+    """Root over every file entry of a manifest's ``merkle.files`` map."""
+    return merkle_root([file_leaf(path, files[path]['root']) for path in sorted(files)])
+
+
+class FileHasher:
+    """Incrementally computes a file's SHA-256 and its chunk hashes in one pass."""
+
+    def __init__(self, chunk_size=MERKLE_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.size = 0
+        self.chunks = []
+        self._sha256 = hashlib.sha256()
+        self._pending = bytearray()
+
+    def update(self, data):
+        self._sha256.update(data)
+        self.size += len(data)
+        self._pending += data
+        while len(self._pending) >= self.chunk_size:
+            self.chunks.append(chunk_hash(bytes(self._pending[:self.chunk_size])))
+            del self._pending[:self.chunk_size]
+
+    def hexdigest(self):
+        return self._sha256.hexdigest()
+
+    def tree(self):
+        """Return the manifest entry for this file: size, chunk hashes and their root."""
+        chunks = list(self.chunks)
+        if self._pending or not chunks:
+            chunks.append(chunk_hash(bytes(self._pending)))
+        return {
+            'size': self.size,
+            'root': merkle_root(chunks),
+            'chunks': chunks
+        }
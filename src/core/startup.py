@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+import time
+import threading
+
+
+class StartupTimer:
+    """Records how long each startup phase takes, for the launch report."""
+
+    def __init__(self, started=None):
+        # perf_counter() taken as early as possible, before the heavy imports
+        self.started = time.perf_counter() if started is None else started
+        self._last = self.started
+        self.phases = []
+        self.first_request = None
+        self._lock = threading.Lock()
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def report(self):
+        lines = ["Startup timing:"]
+        for phase, seconds in self.phases:
+            lines.append(f"  {phase:<28} {seconds * 1000:8.1f} ms")
+        lines.append(f"  {'total':<28} {(self._last - self.started) * 1000:8.1f} ms")
+        return '\n'.join(lines)
+
+    def first_request_served(self):
+        """Remember (once) how long it took until the first response went out; return True the first time."""
+        if self.first_request is not None:
+            return False
+        with self._lock:
+            if self.first_request is not None:
+                return False
+            self.first_request = self.elapsed()
+            return True
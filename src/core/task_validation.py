@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+import re
+import shlex
+from tools.portable.runner import run_streaming
+from tools.portable.jobs import CACHED
+
+# Seconds a validation command may run unless its task sets validation.timeout
+DEFAULT_VALIDATION_TIMEOUT = 120
+
+# Task inputs may only be plain values, never extra command-line flags
+INPUT_NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+PLACEHOLDER = re.compile(r'\{([A-Za-z_][A-Za-z0-9_]*)\}')
+
+
+class ValidationError(Exception):
+    """Raised when a task can't be validated (no check defined, bad inputs, ...)."""
+
+
+class ToolNotReadyError(ValidationError):
+    """Raised when a check needs a tool that is still being installed."""
+
+
+class OutputMatcher:
+    """Finds every ``output_contains`` pattern in streamed output.
+
+    Each line is searched only for the patterns not found yet, so the
+    work shrinks as patterns are found and a pattern sharing a prefix
+    (or a starting offset) with another one is still recorded. The tail
+    of each stream's previous line is kept so a pattern split across
+    lines still matches, but never across stdout and stderr.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = list(dict.fromkeys(patterns))
+        self.found = set()
+        self._tails = {}
+        self._overlap = max((len(pattern) for pattern in self.patterns), default=1) - 1
+
+    @property
+    def done(self):
+        return len(self.found) == len(self.patterns)
+
+    def feed(self, text, stream='stdout'):
+        if self.done:
+            return
+        window = self._tails.get(stream, '') + text
+        for index, pattern in enumerate(self.patterns):
+            if index not in self.found and pattern in window:
+                self.found.add(index)
+        self._tails[stream] = window[-self._overlap:] if self._overlap else ''
+
+    def missing(self):
+        return [pattern for index, pattern in enumerate(self.patterns) if index not in self.found]
+
+
+def parse_criteria(criteria):
+    """Split success_criteria into (expected return code or None, output patterns)."""
+    return_code = None
+    patterns = []
+    for criterion in criteria or []:
+        if not isinstance(criterion, dict):
+            raise ValidationError(f"Invalid success criterion: {criterion!r}")
+        for key, value in criterion.items():
+            if key == 'return_code':
+                return_code = int(value)
+            elif key == 'output_contains':
+                patterns.extend(value if isinstance(value, list) else [value])
+            else:
+                raise ValidationError(f"Unsupported success criterion: {key}")
+    return return_code, [str(pattern) for pattern in patterns]
+
+
+def build_command(command, inputs=None):
+    """Split a task's command, filling ``{name}`` placeholders from ``inputs``.
+
+    Input values are substituted as single arguments and may not start
+    with '-', so a student can't smuggle extra options into the command.
+    """
+    inputs = inputs or {}
+    for name, value in inputs.items():
+        if not INPUT_NAME.match(str(name)):
+            raise ValidationError(f"Invalid input name: {name}")
+        if not isinstance(value, (str, int, float)) or str(value).startswith('-'):
+            raise ValidationError(f"Invalid value for {name}")
+
+    def substitute(match):
+        name = match.group(1)
+        if name not in inputs:
+            raise ValidationError(f"Missing input: {name}")
+        return shlex.quote(str(inputs[name]))
+    return shlex.split(PLACEHOLDER.sub(substitute, command))
+
+
+def run_validation(argv, criteria, on_passed=None, job=None):
+    """Run a validation command and check its success criteria.
+
+    Output patterns are matched while the command streams its output.
+    Returns a result dict; ``success`` is True only if every criterion
+    passed, in which case ``on_passed`` is called.
+    """
+    expected_code, patterns = parse_criteria(criteria)
+    matcher = OutputMatcher(patterns)
+
+    def on_line(stream, line):
+        matcher.feed(line, stream)
+        if job is not None:
+            job.append_output(stream, line)
+
+    try:
+        return_code, stdout, stderr, stats = run_streaming(argv, job=job, on_line=on_line)
+        # Only the streamed lines are checked; the stored output isn't needed
+        stdout.close()
+        stderr.close()
+    except OSError as e:
+        return {'success': False, 'error': f"Could not run {argv[0]}: {str(e)}", 'checks': []}
+
+    checks = []
+    if expected_code is not None:
+        checks.append({'return_code': expected_code, 'actual': return_code,
+                       'passed': return_code == expected_code})
+    for index, pattern in enumerate(matcher.patterns):
+        checks.append({'output_contains': pattern, 'passed': index in matcher.found})
+    passed = all(check['passed'] for check in checks)
+    if passed and on_passed is not None:
+        on_passed()
+    return {
+        'success': passed,
+        'return_code': return_code,
+        'checks': checks,
+        'missing': matcher.missing(),
+        'stats': stats
+    }
+
+
+class TaskValidator:
+    """Runs the ``validation`` checks declared by crate tasks.
+
+    Checks run as background jobs on the scan job manager under the
+    'validation' tool, so they share its concurrency limits, timeouts,
+    in-flight deduplication and result cache; results are keyed by
+    (crate version, task, inputs). ``resolve_command`` can map a
+    command's executable to the provisioned tool (e.g. theHarvester's
+    venv), and ``on_passed(module_name, task_id)`` is called when a task
+    passes, so progress can be updated without the student ticking it.
+    """
+
+    def __init__(self, jobs, resolve_command=None, on_passed=None,
+                 default_timeout=DEFAULT_VALIDATION_TIMEOUT):
+        self.jobs = jobs
+        self.resolve_command = resolve_command
+        self.on_passed = on_passed
+        self.default_timeout = default_timeout
+
+    def validate(self, entry, task_id, inputs=None, refresh=False):
+        """Queue the check for one task of a catalog entry; return (job, source)."""
+        task = next((task for task in entry.manifest.get('tasks', []) if task.get('id') == task_id), None)
+        if task is None:
+            raise ValidationError(f"Task not found: {task_id}")
+        validation = task.get('validation') or {}
+        if validation.get('type') != 'command' or not validation.get('command'):
+            raise ValidationError(f"Task {task_id} has no automatic check")
+
+        inputs = dict(inputs or {})
+        argv = build_command(validation['command'], inputs)
+        if self.resolve_command is not None:
+            argv = self.resolve_command(argv)
+        criteria = validation.get('success_criteria') or []
+        parse_criteria(criteria)
+
+        module_name = entry.display_name
+
+        def mark_passed():
+            self.on_passed(module_name, task_id)
+        callback = mark_passed if self.on_passed is not None else None
+
+        cache_key = ('validation', entry.manifest_hash, task_id,
+                     tuple(sorted((str(name), str(value)) for name, value in inputs.items())))
+        job, source = self.jobs.submit_shared(
+            'validation', run_validation, argv, criteria, on_passed=callback,
+            cache_key=cache_key, refresh=refresh,
+            timeout=validation.get('timeout', self.default_timeout))
+        if source == CACHED and callback is not None:
+            # A cached pass still marks the task (progress may have been reset since)
+            callback()
+        return job, source
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+import os
+import sys
+import copy
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+import yaml
+
+# Add the project root to the path so the export below also runs as a script
+project_root = Path(__file__).parent.parent.parent
+sys.path.append(str(project_root))
+
+from tools.portable.logs import get_logger
+
+logger = get_logger('progress')
+
+# Task statuses the progress store accepts; anything else is stored as pending
+VALID_STATUSES = ('completed', 'pending')
+
+
+class ProgressStore:
+    """SQLite-backed store for student progress.
+
+    Each task status is its own row, so an update only writes the tasks
+    that changed. The database runs in WAL mode and every write is one
+    IMMEDIATE transaction, which keeps updates atomic across a crash and
+    serialises concurrent writers instead of losing their changes. An
+    existing progress.yaml is imported on first use and the progress
+    can always be exported back to YAML.
+
+    Every committed change bumps a monotonically increasing version, and
+    the last document read is kept per version, so callers can answer
+    "has anything changed?" without touching the database.
+
+    If ``write_stats`` is given (see tools.portable.storage), the bytes
+    each write transaction sends to disk are counted under 'progress'.
+    """
+
+    def __init__(self, db_file, yaml_file=None, write_stats=None):
+        self.db_file = Path(db_file)
+        self.yaml_file = Path(yaml_file) if yaml_file else None
+        self.write_stats = write_stats
+        self._local = threading.local()
+        self._state_lock = threading.Lock()
+        self._changed = threading.Condition(self._state_lock)
+        self._version = 0
+        self._snapshot = None
+        self.db_file.parent.mkdir(parents=True, exist_ok=True)
+        self.initialize_database()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_file), timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            self._local.conn = conn
+        return conn
+
+    def initialize_database(self):
+        conn = self._connect()
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS progress_modules (
+                name TEXT PRIMARY KEY
+            );
+            CREATE TABLE IF NOT EXISTS progress_tasks (
+                module TEXT NOT NULL REFERENCES progress_modules(name) ON DELETE CASCADE,
+                task_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (module, task_id)
+            );
+            CREATE TABLE IF NOT EXISTS progress_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            INSERT OR IGNORE INTO progress_meta (key, value) VALUES ('version', '0');
+        ''')
+        self._version = self._read_version(conn)
+        imported = conn.execute("SELECT value FROM progress_meta WHERE key = 'yaml_imported'").fetchone()
+        if imported is None:
+            self._import_yaml()
+
+    def _import_yaml(self):
+        """Import progress.yaml from before the store existed, once."""
+        data = None
+        if self.yaml_file and self.yaml_file.exists():
+            try:
+                with open(self.yaml_file, 'r') as f:
+                    data = yaml.safe_load(f)
+            except Exception as e:
+                logger.error("Error importing progress from %s: %s", self.yaml_file, e)
+        modules = data.get('modules') if isinstance(data, dict) else None
+        with self._transaction() as conn:
+            if isinstance(modules, dict):
+                self._merge_modules(conn, modules)
+            conn.execute("INSERT OR REPLACE INTO progress_meta (key, value) VALUES ('yaml_imported', '1')")
+
+    @staticmethod
+    def _read_version(conn):
+        row = conn.execute("SELECT value FROM progress_meta WHERE key = 'version'").fetchone()
+        return int(row[0]) if row else 0
+
+    @contextmanager
+    def _transaction(self):
+        """Write transaction; bumps the version if anything was modified."""
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        changes_before = conn.total_changes
+        version = None
+        try:
+            yield conn
+            if conn.total_changes != changes_before:
+                conn.execute("UPDATE progress_meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'version'")
+                version = self._read_version(conn)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        if self.write_stats is not None:
+            with self.write_stats.track('progress'):
+                conn.execute('COMMIT')
+        else:
+            conn.execute('COMMIT')
+        if version is not None:
+            self._committed(version)
+
+    def _committed(self, version):
+        with self._state_lock:
+            if version > self._version:
+                self._version = version
+                self._snapshot = None
+                self._changed.notify_all()
+
+    def wait_for_change(self, since_version, timeout=None):
+        """Block until the version differs from ``since_version`` (or timeout); return the version."""
+        with self._changed:
+            self._changed.wait_for(lambda: self._version != since_version, timeout=timeout)
+            return self._version
+
+    @property
+    def version(self):
+        """Version of the latest change committed through this store."""
+        return self._version
+
+    @staticmethod
+    def normalize_status(status):
+        return status if status in VALID_STATUSES else 'pending'
+
+    def _read(self, conn):
+        progress = {'modules': {}}
+        for (name,) in conn.execute('SELECT name FROM progress_modules ORDER BY name'):
+            progress['modules'][name] = {'tasks': {}}
+        for module, task_id, status in conn.execute(
+                'SELECT module, task_id, status FROM progress_tasks ORDER BY module, task_id'):
+            progress['modules'][module]['tasks'][task_id] = status
+        return progress
+
+    def _merge_modules(self, conn, modules):
+        """Replace the task statuses of the given modules, writing only what changed."""
+        for module_name, module_data in modules.items():
+            tasks = {}
+            if isinstance(module_data, dict) and isinstance(module_data.get('tasks'), dict):
+                tasks = {str(task_id): self.normalize_status(status)
+                         for task_id, status in module_data['tasks'].items()}
+            conn.execute('INSERT OR IGNORE INTO progress_modules (name) VALUES (?)', (module_name,))
+            existing = dict(conn.execute(
+                'SELECT task_id, status FROM progress_tasks WHERE module = ?', (module_name,)))
+            changed = [(module_name, task_id, status) for task_id, status in tasks.items()
+                       if existing.get(task_id) != status]
+            removed = [(module_name, task_id) for task_id in existing if task_id not in tasks]
+            if changed:
+                conn.executemany('''
+                    INSERT INTO progress_tasks (module, task_id, status) VALUES (?, ?, ?)
+                    ON CONFLICT (module, task_id)
+                    DO UPDATE SET status = excluded.status, updated_at = CURRENT_TIMESTAMP
+                ''', changed)
+            if removed:
+                conn.executemany('DELETE FROM progress_tasks WHERE module = ? AND task_id = ?', removed)
+
+    def load(self):
+        """Return the progress document: {'modules': {name: {'tasks': {id: status}}}}."""
+        return copy.deepcopy(self.snapshot()[1])
+
+    def snapshot(self):
+        """Return (version, document), reading the database only if the version moved.
+
+        The returned document is shared between callers and must not be modified.
+        """
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot[0] == self._version:
+            return snapshot
+        conn = self._connect()
+        conn.execute('BEGIN')
+        try:
+            version = self._read_version(conn)
+            snapshot = (version, self._read(conn))
+        finally:
+            conn.execute('COMMIT')
+        with self._state_lock:
+            if version >= self._version:
+                self._version = version
+                self._snapshot = snapshot
+        return snapshot
+
+    def merge(self, modules):
+        """Atomically replace the given modules' progress; return (version, full document)."""
+        with self._transaction() as conn:
+            self._merge_modules(conn, modules)
+            progress = self._read(conn)
+        return self._version, progress
+
+    def save(self, progress):
+        """Make the stored progress match a full progress document."""
+        modules = progress.get('modules') or {}
+        with self._transaction() as conn:
+            stale = [(name,) for (name,) in conn.execute('SELECT name FROM progress_modules')
+                     if name not in modules]
+            if stale:
+                conn.executemany('DELETE FROM progress_modules WHERE name = ?', stale)
+            self._merge_modules(conn, modules)
+
+    def set_task_status(self, module_name, task_id, status):
+        """Set a single task's status and return the progress version after the write."""
+        status = self.normalize_status(status)
+        with self._transaction() as conn:
+            conn.execute('INSERT OR IGNORE INTO progress_modules (name) VALUES (?)', (module_name,))
+            conn.execute('''
+                INSERT INTO progress_tasks (module, task_id, status) VALUES (?, ?, ?)
+                ON CONFLICT (module, task_id)
+                DO UPDATE SET status = excluded.status, updated_at = CURRENT_TIMESTAMP
+                WHERE status != excluded.status
+            ''', (module_name, task_id, status))
+        return self._version
+
+    def export_yaml(self, path=None):
+        """Return the progress as YAML, also writing it atomically to ``path`` if given."""
+        text = yaml.dump(self.load(), default_flow_style=False)
+        if path is not None:
+            path = Path(path)
+            temp_path = path.with_name(path.name + '.tmp')
+            with open(temp_path, 'w') as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, path)
+        return text
+
+
+if __name__ == '__main__':
+    # Export the progress database back to progress.yaml
+    progress_dir = project_root / 'data' / 'progress'
+    store = ProgressStore(progress_dir / 'progress.sqlite', progress_dir / 'progress.yaml')
+    store.export_yaml(progress_dir / 'progress.yaml')
+    print(f"Exported progress to {progress_dir / 'progress.yaml'}")
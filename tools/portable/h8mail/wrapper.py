@@ -1,14 +1,16 @@
 import os
-import sys
 import json
-import sqlite3
-import subprocess
 from pathlib import Path
 import platform
-import logging
 import tempfile
 import shutil
-import re
+from tools.portable.runner import run_streaming, strip_ansi, output_fields
+from tools.portable.history import ScanHistory
+from tools.portable.logs import get_logger, add_component_file
+from tools.portable.storage import connect, scratch_dir
+from tools.portable.provision import ToolProvisioner
+
+logger = get_logger('h8mail')
 
 class H8mailWrapper:
     def __init__(self):
@@ -16,80 +18,53 @@ class H8mailWrapper:
         self.config_file = self.tool_dir / 'config' / 'settings.json'
         self.db_file = self.tool_dir / 'config' / 'database.sqlite'
         self.venv_path = self.tool_dir / 'venv'
+        self.provisioner = ToolProvisioner('h8mail', self.venv_path, 'h8mail', 'h8mail')
         self.setup_logging()
+        self.initialize_database()
+        self.history = ScanHistory(self.db_file, columns=('scan_type',), subsystem='history:h8mail')
 
     def setup_logging(self):
         """Set up logging for the wrapper"""
-        log_file = self.tool_dir / 'h8mail.log'
-        logging.basicConfig(
-            filename=str(log_file),
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s'
-        )
+        # Records go through the process-wide logging queue; this adds the tool's own file
+        add_component_file('h8mail', self.tool_dir / 'h8mail.log')
 
     def setup_environment(self):
-        """Set up the complete environment for h8mail"""
-        try:
-            # Create virtual environment
-            if not self.venv_path.exists():
-                logging.info("Creating virtual environment...")
-                subprocess.run([sys.executable, '-m', 'venv', str(self.venv_path)], check=True)
-
-            # Install requirements
-            pip_path = self.venv_path / 'bin' / 'pip' if os.name != 'nt' else self.venv_path / 'Scripts' / 'pip'
-            
-            logging.info("Installing h8mail...")
-            subprocess.run([str(pip_path), 'install', 'h8mail'], check=True)
-
-            # Initialize database if it doesn't exist
-            self.initialize_database()
-
-            logging.info("Environment setup completed successfully")
-            return True
-        except Exception as e:
-            logging.error(f"Environment setup failed: {str(e)}")
-            return False
+        """Make sure h8mail is installed in its venv (a stamp check once it is)"""
+        return self.provisioner.ensure()
 
     def initialize_database(self):
         """Initialize the SQLite database with required tables"""
-        if not self.db_file.exists():
-            logging.info("Initializing database...")
-            conn = sqlite3.connect(str(self.db_file))
-            cursor = conn.cursor()
-            
-            # Create necessary tables
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS scan_history (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    target TEXT,
-                    scan_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    results TEXT,
-                    status TEXT,
-                    scan_type TEXT
-                )
-            ''')
-            
-            conn.commit()
-            conn.close()
+        # The tables are created even if the file exists, as it may be empty
+        conn = connect(self.db_file)
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS scan_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                target TEXT,
+                scan_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                results TEXT,
+                status TEXT,
+                scan_type TEXT
+            )
+        ''')
+        conn.commit()
+        conn.close()
 
     def strip_ansi_codes(self, text):
-        ansi_escape = re.compile(r'\x1B\[[0-?]*[ -/]*[@-~]')
-        return ansi_escape.sub('', text)
+        return strip_ansi(text)
 
-    def run_scan(self, target, scan_type='email', options=None):
-        """Run a scan with h8mail"""
+    def run_scan(self, target, scan_type='email', options=None, job=None):
+        """Run a scan with h8mail (as a job, its timeout and cancellation apply)"""
         try:
             # Ensure environment is set up
             if not self.setup_environment():
                 raise Exception("Environment setup failed")
 
             # Get the Python interpreter from the virtual environment
-            python_path = self.venv_path / 'bin' / 'python'
-            if os.name == 'nt':
-                python_path = self.venv_path / 'Scripts' / 'python'
+            python_path = self.provisioner.python
 
             # Create a temporary file for the target
-            with tempfile.NamedTemporaryFile(mode='w', delete=False) as temp_file:
+            with tempfile.NamedTemporaryFile(mode='w', delete=False, dir=scratch_dir('h8mail')) as temp_file:
                 temp_file.write(target)
                 temp_file_path = temp_file.name
 
@@ -106,85 +81,46 @@ class H8mailWrapper:
                     cmd.append(options['output'])
 
             # Run the scan
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
-            stdout, stderr = process.communicate()
-
-            # Strip ANSI codes
-            stdout = self.strip_ansi_codes(stdout)
-            stderr = self.strip_ansi_codes(stderr)
+            return_code, stdout, stderr, stats = run_streaming(cmd, job=job)
 
             # Clean up temporary file
             os.unlink(temp_file_path)
 
-            # Store results in database
-            self.store_scan_results(target, stdout, stderr, process.returncode, scan_type)
+            # Store results in database; the result only carries the end of the output
+            with stdout, stderr:
+                scan_id = self.store_scan_results(target, stdout, stderr, return_code, scan_type)
+                fields = output_fields(stdout, stderr)
 
             return {
-                'success': process.returncode == 0,
-                'stdout': stdout,
-                'stderr': stderr,
-                'return_code': process.returncode
+                'success': return_code == 0,
+                **fields,
+                'return_code': return_code,
+                'stats': stats,
+                'scan_id': scan_id
             }
         except Exception as e:
-            logging.error(f"Scan failed: {str(e)}")
+            logger.error("Scan failed: %s", e)
             return {
                 'success': False,
                 'error': str(e)
             }
 
     def store_scan_results(self, target, stdout, stderr, return_code, scan_type):
-        """Store scan results in the database"""
+        """Store scan results in the database (output is compressed separately); return the scan id"""
         try:
-            conn = sqlite3.connect(str(self.db_file))
-            cursor = conn.cursor()
-            
             status = 'success' if return_code == 0 else 'failed'
-            results = json.dumps({
-                'stdout': stdout,
-                'stderr': stderr,
-                'return_code': return_code
-            })
-            
-            cursor.execute('''
-                INSERT INTO scan_history (target, results, status, scan_type)
-                VALUES (?, ?, ?, ?)
-            ''', (target, results, status, scan_type))
-            
-            conn.commit()
-            conn.close()
+            return self.history.record(target, status, stdout, stderr, return_code, scan_type=scan_type)
         except Exception as e:
-            logging.error(f"Failed to store scan results: {str(e)}")
+            logger.error("Failed to store scan results: %s", e)
+            return None
 
-    def get_scan_history(self, limit=10):
-        """Retrieve recent scan history"""
+    def get_scan_history(self, limit=10, **filters):
+        """Retrieve recent scan history (see ScanHistory.query for filters)"""
         try:
-            conn = sqlite3.connect(str(self.db_file))
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT target, scan_date, status, scan_type, results
-                FROM scan_history
-                ORDER BY scan_date DESC
-                LIMIT ?
-            ''', (limit,))
-            
-            results = cursor.fetchall()
-            conn.close()
-            
-            return [{
-                'target': row[0],
-                'scan_date': row[1],
-                'status': row[2],
-                'scan_type': row[3],
-                'results': json.loads(row[4])
-            } for row in results]
+            scans, _ = self.history.query(limit=limit, **filters)
+            return scans
         except Exception as e:
-            logging.error(f"Failed to retrieve scan history: {str(e)}")
+            logger.error("Failed to retrieve scan history: %s", e)
             return []
 
 if __name__ == '__main__':
@@ -0,0 +1,306 @@
+import json
+import lzma
+import zlib
+import base64
+import sqlite3
+import threading
+from tools.portable.storage import connect, write_lock, write_stats
+
+# Page size used when a caller doesn't ask for one, and the most a page may hold
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 200
+
+# Codec used for new output blobs; both are readable whatever this is set to
+OUTPUT_CODEC = 'zlib'
+
+# codec: (compressor factory, decompress)
+_CODECS = {
+    'zlib': (lambda: zlib.compressobj(6), zlib.decompress),
+    'lzma': (lzma.LZMACompressor, lzma.decompress)
+}
+
+# Output metadata returned with every history row (the blobs themselves are not)
+OUTPUT_METADATA = ('return_code', 'stdout_bytes', 'stdout_lines', 'stderr_bytes',
+                   'stderr_lines', 'stored_bytes')
+
+
+def encode_cursor(scan_date, scan_id):
+    """Opaque pagination cursor pointing just past the given row."""
+    raw = json.dumps([scan_date, scan_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return (scan_date, id) from a cursor; raises ValueError if it is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        scan_date, scan_id = json.loads(raw)
+        return scan_date, int(scan_id)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+
+def compress_output(output, codec=OUTPUT_CODEC):
+    """Return (blob, byte_count, line_count) for one output stream.
+
+    ``output`` is text or an iterable of text/byte chunks, such as a
+    runner OutputBuffer; chunks are compressed as they are read, so
+    spilled output is never loaded whole.
+    """
+    if output is None or isinstance(output, str):
+        output = [output or '']
+    compressor = _CODECS[codec][0]()
+    blob, size, lines, last = [], 0, 0, b''
+    for chunk in output:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        if not chunk:
+            continue
+        blob.append(compressor.compress(chunk))
+        size += len(chunk)
+        lines += chunk.count(b'\n')
+        last = chunk[-1:]
+    blob.append(compressor.flush())
+    # A final unterminated line counts too
+    if last and last != b'\n':
+        lines += 1
+    return b''.join(blob), size, lines
+
+
+def decompress_output(blob, codec):
+    if blob is None:
+        return ''
+    return _CODECS[codec][1](blob).decode('utf-8')
+
+
+class ScanHistory:
+    """Access to a wrapper's scan history.
+
+    Every wrapper stores its scans in a ``scan_history`` table with
+    ``id``, ``target``, ``scan_date`` and ``status`` plus tool-specific
+    columns. Scan output lives compressed in a separate ``scan_output``
+    table, so listings only read metadata (sizes and line counts) and the
+    output of a scan is decompressed when it is asked for.
+
+    Pages are ordered newest first and fetched by keyset (``scan_date``,
+    ``id``) rather than OFFSET, so deep pages cost the same as the first
+    one. Connections are kept per thread and run in WAL mode with relaxed
+    syncing; bytes written are counted under ``subsystem``.
+    """
+
+    def __init__(self, db_file, columns=(), json_columns=(), subsystem='history'):
+        self.db_file = db_file
+        self.subsystem = subsystem
+        self.columns = tuple(columns)
+        self.json_columns = frozenset(json_columns)
+        self._local = threading.local()
+        self._ready = False
+        self._schema_lock = threading.Lock()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = connect(self.db_file)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        if not self._ready:
+            self.ensure_schema(conn)
+        return conn
+
+    def ensure_schema(self, conn=None):
+        """Create the output table and history indexes once scan_history exists.
+
+        Rows written before outputs were compressed keep their output as
+        JSON in ``scan_history.results``; they are moved into
+        ``scan_output`` here, once.
+        """
+        conn = conn or self._connect()
+        with self._schema_lock:
+            if self._ready:
+                return
+            exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'scan_history'").fetchone()
+            if exists is None:
+                return
+            conn.executescript('''
+                CREATE INDEX IF NOT EXISTS idx_scan_history_target_date
+                    ON scan_history (target, scan_date DESC, id DESC);
+                CREATE INDEX IF NOT EXISTS idx_scan_history_date
+                    ON scan_history (scan_date DESC, id DESC);
+                CREATE TABLE IF NOT EXISTS scan_output (
+                    scan_id INTEGER PRIMARY KEY REFERENCES scan_history(id) ON DELETE CASCADE,
+                    return_code INTEGER,
+                    stdout_bytes INTEGER,
+                    stdout_lines INTEGER,
+                    stderr_bytes INTEGER,
+                    stderr_lines INTEGER,
+                    stored_bytes INTEGER,
+                    codec TEXT NOT NULL,
+                    stdout BLOB,
+                    stderr BLOB
+                );
+            ''')
+            self._migrate_results(conn)
+            self._ready = True
+
+    def _migrate_results(self, conn):
+        legacy = conn.execute('''
+            SELECT id, results FROM scan_history
+            WHERE results IS NOT NULL AND id NOT IN (SELECT scan_id FROM scan_output)
+        ''').fetchall()
+        if not legacy:
+            return
+        with conn:
+            for row in legacy:
+                try:
+                    results = json.loads(row['results'])
+                except ValueError:
+                    results = {'stdout': row['results']}
+                if not isinstance(results, dict):
+                    results = {'stdout': str(results)}
+                self._write_output(conn, row['id'], self._pack_output(
+                    results.get('stdout'), results.get('stderr'), results.get('return_code')))
+            conn.executemany('UPDATE scan_history SET results = NULL WHERE id = ?',
+                             [(row['id'],) for row in legacy])
+        # Give the space of the old JSON text back to the file system
+        conn.execute('VACUUM')
+
+    @staticmethod
+    def _pack_output(stdout, stderr, return_code):
+        stdout_blob, stdout_bytes, stdout_lines = compress_output(stdout)
+        stderr_blob, stderr_bytes, stderr_lines = compress_output(stderr)
+        return (return_code, stdout_bytes, stdout_lines, stderr_bytes, stderr_lines,
+                len(stdout_blob) + len(stderr_blob), OUTPUT_CODEC, stdout_blob, stderr_blob)
+
+    @staticmethod
+    def _write_output(conn, scan_id, packed):
+        conn.execute('''
+            INSERT OR REPLACE INTO scan_output
+                (scan_id, return_code, stdout_bytes, stdout_lines, stderr_bytes, stderr_lines,
+                 stored_bytes, codec, stdout, stderr)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (scan_id,) + packed)
+
+    def record(self, target, status, stdout, stderr, return_code, **columns):
+        """Store a finished scan with its compressed output; return the new scan id.
+
+        ``stdout``/``stderr`` are text or chunk iterables (see
+        compress_output). ``columns`` fills the tool-specific scan_history columns.
+        """
+        names = ['target', 'status'] + list(columns)
+        values = [target, status]
+        for name, value in columns.items():
+            values.append(json.dumps(value) if name in self.json_columns else value)
+        # Compressed before taking the write lock, so other writers don't wait on it
+        packed = self._pack_output(stdout, stderr, return_code)
+        conn = self._connect()
+        with write_lock(self.db_file), write_stats.track(self.subsystem), conn:
+            cursor = conn.execute(
+                f"INSERT INTO scan_history ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})",
+                values)
+            scan_id = cursor.lastrowid
+            self._write_output(conn, scan_id, packed)
+        return scan_id
+
+    def _row(self, row):
+        scan = {'id': row['id'], 'target': row['target'],
+                'scan_date': row['scan_date'], 'status': row['status']}
+        for column in self.columns:
+            value = row[column]
+            if column in self.json_columns and value is not None:
+                value = json.loads(value)
+            scan[column] = value
+        for column in OUTPUT_METADATA:
+            scan[column] = row[column]
+        return scan
+
+    def _select(self):
+        columns = [f'h.{name}' for name in ('id', 'target', 'scan_date', 'status') + self.columns]
+        columns += [f'o.{name}' for name in OUTPUT_METADATA]
+        return (f"SELECT {', '.join(columns)} FROM scan_history h "
+                'LEFT JOIN scan_output o ON o.scan_id = h.id')
+
+    def query(self, limit=DEFAULT_PAGE_SIZE, cursor=None, target=None, status=None,
+              since=None, until=None):
+        """Return (scans, next_cursor) for one page of history, newest first.
+
+        Each scan carries its output sizes and line counts but not the
+        output itself (see ``output``). ``since``/``until`` bound
+        ``scan_date`` (inclusive, 'YYYY-MM-DD[ HH:MM:SS]').
+        ``next_cursor`` is None on the last page.
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        clauses, params = [], []
+        if target is not None:
+            clauses.append('h.target = ?')
+            params.append(target)
+        if status is not None:
+            clauses.append('h.status = ?')
+            params.append(status)
+        if since is not None:
+            clauses.append('h.scan_date >= ?')
+            params.append(since)
+        if until is not None:
+            # A bare date covers the whole day
+            clauses.append('h.scan_date <= ?')
+            params.append(until if len(until) > 10 else until + ' 23:59:59')
+        if cursor is not None:
+            scan_date, scan_id = decode_cursor(cursor)
+            clauses.append('(h.scan_date < ? OR (h.scan_date = ? AND h.id < ?))')
+            params.extend([scan_date, scan_date, scan_id])
+        query = self._select()
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+        query += ' ORDER BY h.scan_date DESC, h.id DESC LIMIT ?'
+        # One extra row tells us whether there is another page
+        params.append(limit + 1)
+
+        try:
+            rows = self._connect().execute(query, params).fetchall()
+        except sqlite3.OperationalError as e:
+            if 'no such table' in str(e):
+                return [], None
+            raise
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]['scan_date'], rows[-1]['id'])
+        return [self._row(row) for row in rows], next_cursor
+
+    def output(self, scan_id):
+        """Decompressed {'stdout', 'stderr', 'return_code'} of one scan, or None."""
+        try:
+            row = self._connect().execute(
+                'SELECT return_code, codec, stdout, stderr FROM scan_output WHERE scan_id = ?',
+                (scan_id,)).fetchone()
+        except sqlite3.OperationalError as e:
+            if 'no such table' in str(e):
+                return None
+            raise
+        if row is None:
+            return None
+        return {
+            'stdout': decompress_output(row['stdout'], row['codec']),
+            'stderr': decompress_output(row['stderr'], row['codec']),
+            'return_code': row['return_code']
+        }
+
+    def latest(self, target, include_output=True):
+        """Most recent scan of ``target`` (with its output under 'results'), or None."""
+        scans, _ = self.query(limit=1, target=target)
+        if not scans:
+            return None
+        scan = scans[0]
+        if include_output:
+            scan['results'] = self.output(scan['id'])
+        return scan
+
+    def get(self, scan_id, include_output=False):
+        """A single scan by id, or None."""
+        row = self._connect().execute(self._select() + ' WHERE h.id = ?', (scan_id,)).fetchone()
+        if row is None:
+            return None
+        scan = self._row(row)
+        if include_output:
+            scan['results'] = self.output(scan_id)
+        return scan
@@ -0,0 +1,316 @@
+import time
+import uuid
+import threading
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from tools.portable.runner import terminate_process, RESULT_TAIL_BYTES
+from tools.portable.scan_cache import ResultCache
+from tools.portable.logs import get_logger
+
+logger = get_logger('jobs')
+
+# Job states; the last four are final
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+TIMED_OUT = 'timed_out'
+FINAL_STATES = (COMPLETED, FAILED, CANCELLED, TIMED_OUT)
+
+# Recent output lines kept per job for live viewers; older lines are dropped
+OUTPUT_BUFFER_LINES = 2000
+
+# Output kept per stream in a finished job's result; the full output stays in the scan history
+RESULT_OUTPUT_CHARS = RESULT_TAIL_BYTES
+
+# How submit_shared() satisfied a request
+NEW = 'new'
+IN_FLIGHT = 'in_flight'
+CACHED = 'cached'
+
+
+def bound_output(result, max_chars=RESULT_OUTPUT_CHARS):
+    """Keep only the tail of a scan result's stdout/stderr.
+
+    Finished jobs stay in memory (and in the result cache), so they hold
+    the last ``max_chars`` of each stream, cut at a line start, with
+    ``<stream>_truncated`` set; clients fetch the full output through
+    the result's ``scan_id``.
+    """
+    if not isinstance(result, dict):
+        return result
+    for stream in ('stdout', 'stderr'):
+        text = result.get(stream)
+        if isinstance(text, str) and len(text) > max_chars:
+            tail = text[-max_chars:]
+            newline = tail.find('\n')
+            if 0 <= newline < len(tail) - 1:
+                tail = tail[newline + 1:]
+            result[stream] = tail
+            result[f'{stream}_truncated'] = True
+    return result
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at its depth limit."""
+
+
+class _Cancelled(Exception):
+    pass
+
+
+class ScanJob:
+    """A scan submitted to the job manager."""
+
+    def __init__(self, tool, func, args, kwargs, timeout=None):
+        self.id = uuid.uuid4().hex
+        self.tool = tool
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.timeout = timeout
+        self.cache_key = None
+        # Callers sharing this job (see submit_shared); cancelling stops it only when the last one leaves
+        self.callers = 1
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.timed_out = False
+        self.stats = None
+        self.progress = None
+        self.cancel_requested = False
+        self._processes = []
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._output = deque(maxlen=OUTPUT_BUFFER_LINES)
+        self._output_seq = 0
+        self._output_changed = threading.Condition()
+
+    def attach_process(self, process):
+        """Remember a child process so it can be killed on cancel (a job may run several)."""
+        with self._lock:
+            self._processes = [p for p in self._processes if p.returncode is None]
+            self._processes.append(process)
+            cancel = self.cancel_requested
+        if cancel:
+            terminate_process(process)
+
+    def append_output(self, stream, line):
+        """Record one line of live output (called from the runner's reader threads)."""
+        with self._output_changed:
+            self._output_seq += 1
+            self._output.append((self._output_seq, stream, line))
+            self._output_changed.notify_all()
+
+    def read_output(self, after_seq, timeout=None):
+        """Return (lines, finished) with every buffered line newer than ``after_seq``.
+
+        Waits up to ``timeout`` for new output. ``lines`` is a list of
+        (seq, stream, line); a gap in seq means older lines were dropped.
+        """
+        with self._output_changed:
+            self._output_changed.wait_for(
+                lambda: self._output_seq > after_seq or self._done.is_set(), timeout=timeout)
+            lines = [entry for entry in self._output if entry[0] > after_seq]
+            return lines, self._done.is_set()
+
+    def _finish(self):
+        with self._output_changed:
+            self._done.set()
+            self._output_changed.notify_all()
+
+    def remaining_time(self):
+        """Seconds left before the job's timeout, or None for no limit."""
+        if self.timeout is None:
+            return None
+        started = self.started_at or time.time()
+        return max(0.0, self.timeout - (time.time() - started))
+
+    def cancel(self):
+        with self._lock:
+            self.cancel_requested = True
+            processes = list(self._processes)
+        for process in processes:
+            terminate_process(process)
+
+    def wait(self, timeout=None):
+        """Block until the job reaches a final state; return True if it did."""
+        return self._done.wait(timeout)
+
+    def to_dict(self, include_result=True):
+        data = {
+            'job_id': self.id,
+            'tool': self.tool,
+            'status': self.status,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'timeout': self.timeout
+        }
+        if self.stats is not None:
+            data['stats'] = self.stats
+        if self.progress is not None:
+            data['progress'] = self.progress
+        if self.error:
+            data['error'] = self.error
+        if include_result and self.result is not None:
+            data['result'] = self.result
+        return data
+
+
+class ScanJobManager:
+    """Runs scans in the background on a bounded worker pool.
+
+    Each tool has its own concurrency limit and the number of queued jobs
+    is capped, so a burst of submissions can't pile up unbounded work.
+    Finished jobs are kept (up to ``max_finished``) for their results.
+
+    Scans submitted with a cache key (see ``submit_shared``) are shared:
+    an identical scan already queued or running is joined instead of
+    started again, and a successful result is reused for ``result_ttl``
+    seconds.
+    """
+
+    def __init__(self, max_workers=4, max_queued=32, tool_limits=None,
+                 default_timeout=900, max_finished=200, result_ttl=300, max_cached=64):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.tool_limits = dict(tool_limits or {})
+        self.default_timeout = default_timeout
+        self.max_finished = max_finished
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='scan-job')
+        # Re-entrant: submit_shared() calls submit() with the lock held
+        self._lock = threading.RLock()
+        self._queue = deque()
+        self._running = {}
+        self._jobs = OrderedDict()
+        self._in_flight = {}
+        self.results = ResultCache(ttl=result_ttl, max_entries=max_cached)
+
+    def submit(self, tool, func, *args, timeout=None, **kwargs):
+        """Queue ``func(*args, job=job, **kwargs)`` and return the job immediately."""
+        job = ScanJob(tool, func, args, kwargs,
+                      timeout=timeout if timeout is not None else self.default_timeout)
+        with self._lock:
+            if len(self._queue) >= self.max_queued:
+                raise QueueFullError(f"Too many queued scans (limit {self.max_queued}), try again later")
+            self._jobs[job.id] = job
+            self._queue.append(job)
+            self._dispatch()
+        return job
+
+    def submit_shared(self, tool, func, *args, cache_key, refresh=False, timeout=None, **kwargs):
+        """Like ``submit``, but identical scans share one job.
+
+        Returns (job, source): source is NEW for a freshly queued job,
+        IN_FLIGHT when an identical queued or running job was joined and
+        CACHED when a finished job's result is still fresh. ``refresh``
+        skips the result cache (an in-flight scan is still joined, since
+        its result will be new anyway).
+        """
+        with self._lock:
+            job = self._in_flight.get(cache_key)
+            # A job being cancelled can't be joined; the new caller gets a fresh one
+            if job is not None and job.status not in FINAL_STATES and not job.cancel_requested:
+                job.callers += 1
+                return job, IN_FLIGHT
+            if not refresh:
+                job = self.results.get(cache_key)
+                if job is not None:
+                    # Keep the job reachable through /jobs while it is being reused
+                    self._jobs[job.id] = job
+                    self._jobs.move_to_end(job.id)
+                    return job, CACHED
+            job = self.submit(tool, func, *args, timeout=timeout, **kwargs)
+            job.cache_key = cache_key
+            self._in_flight[cache_key] = job
+        return job, NEW
+
+    def _dispatch(self):
+        # Called with the lock held: start every queued job that has a free slot
+        running_total = sum(self._running.values())
+        for job in list(self._queue):
+            if running_total >= self.max_workers:
+                break
+            limit = self.tool_limits.get(job.tool, self.max_workers)
+            if self._running.get(job.tool, 0) >= limit:
+                continue
+            self._queue.remove(job)
+            self._running[job.tool] = self._running.get(job.tool, 0) + 1
+            running_total += 1
+            job.status = RUNNING
+            job.started_at = time.time()
+            self._executor.submit(self._run, job)
+
+    def _run(self, job):
+        try:
+            if job.cancel_requested:
+                raise _Cancelled()
+            job.result = bound_output(job.func(*job.args, job=job, **job.kwargs))
+            if job.cancel_requested:
+                job.status = CANCELLED
+            elif job.timed_out:
+                job.status = TIMED_OUT
+                job.error = f"Scan timed out after {job.timeout}s"
+            else:
+                job.status = COMPLETED
+        except _Cancelled:
+            job.status = CANCELLED
+        except Exception as e:
+            logger.error("Job %s (%s) failed: %s", job.id, job.tool, e)
+            job.status = FAILED
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                if job.cache_key is not None:
+                    if self._in_flight.get(job.cache_key) is job:
+                        del self._in_flight[job.cache_key]
+                    if job.status == COMPLETED and isinstance(job.result, dict) and job.result.get('success'):
+                        self.results.put(job.cache_key, job)
+                self._running[job.tool] -= 1
+                self._prune()
+                self._dispatch()
+            job._finish()
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in FINAL_STATES]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def list(self, tool=None):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [job for job in jobs if tool is None or job.tool == tool]
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job; return the job, or None if unknown.
+
+        A job joined by several callers through submit_shared() keeps
+        running until each of them has cancelled it; earlier cancels
+        only drop one caller.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job.status not in FINAL_STATES and job.callers > 1:
+                job.callers -= 1
+                return job
+            if job.status == QUEUED:
+                self._queue.remove(job)
+                job.cancel_requested = True
+                job.status = CANCELLED
+                job.finished_at = time.time()
+                job._finish()
+                return job
+        if job.status == RUNNING:
+            job.cancel()
+        return job
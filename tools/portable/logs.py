@@ -0,0 +1,137 @@
+import os
+import sys
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+import threading
+from tools.portable.storage import CoalescingFileHandler
+
+# Every CyberCrate logger lives under this name, e.g. 'cybercrate.nmap'
+LOGGER_NAME = 'cybercrate'
+
+# Default level, and per-component overrides such as "nmap=DEBUG,web=WARNING"
+LOG_LEVEL = os.environ.get('CYBERCRATE_LOG_LEVEL', 'INFO').upper()
+LOG_LEVELS = os.environ.get('CYBERCRATE_LOG_LEVELS', '')
+
+# Log files are rotated at this size, keeping this many old files
+LOG_MAX_BYTES = int(os.environ.get('CYBERCRATE_LOG_MAX_KB', '1024')) * 1024
+LOG_BACKUPS = int(os.environ.get('CYBERCRATE_LOG_BACKUPS', '3'))
+
+FILE_FORMAT = '%(asctime)s - %(levelname)s - %(name)s - %(message)s'
+COMPONENT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+CONSOLE_FORMAT = '%(levelname)s %(name)s: %(message)s'
+
+
+def get_logger(component):
+    """Logger for one part of CyberCrate ('web', 'nmap', 'catalog', ...)."""
+    return logging.getLogger(f'{LOGGER_NAME}.{component}')
+
+
+class lazy_json:
+    """Serializes ``value`` only if the log record is actually formatted.
+
+    Pass it as a logging argument (``logger.debug('%s', lazy_json(doc))``)
+    so a disabled debug line costs nothing.
+    """
+
+    __slots__ = ('value', 'indent')
+
+    def __init__(self, value, indent=None):
+        self.value = value
+        self.indent = indent
+
+    def __str__(self):
+        return json.dumps(self.value, indent=self.indent, default=str)
+
+
+def _file_handler(path, log_format):
+    handler = CoalescingFileHandler(path, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUPS)
+    handler.setFormatter(logging.Formatter(log_format))
+    return handler
+
+
+class _Router(logging.Handler):
+    """Runs on the listener thread: sends every record to the process log
+    and the console, and a component's records to its own file too."""
+
+    def __init__(self):
+        super().__init__()
+        self.handlers = []
+        self.components = {}
+
+    def emit(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+        parts = record.name.split('.')
+        handler = self.components.get(parts[1]) if len(parts) > 1 and parts[0] == LOGGER_NAME else None
+        if handler is not None:
+            handler.handle(record)
+
+
+_router = _Router()
+_queue = queue.SimpleQueue()
+_listener = None
+_lock = threading.Lock()
+
+
+def add_component_file(component, path):
+    """Also write ``component``'s records to ``path`` (e.g. a tool's own log)."""
+    with _lock:
+        if component not in _router.components:
+            _router.components[component] = _file_handler(path, COMPONENT_FORMAT)
+
+
+def _parse_levels(spec):
+    levels = {}
+    for item in spec.split(','):
+        if '=' in item:
+            component, level = item.split('=', 1)
+            levels[component.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_logging(log_file, level=None, levels=None, console=True):
+    """Set up logging for the whole process; later calls do nothing.
+
+    Loggers only put records on a queue; a QueueListener thread formats
+    them and writes the rotating log files, so a request never waits on
+    the disk.
+    """
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return
+        os.makedirs(os.path.dirname(str(log_file)), exist_ok=True)
+        _router.handlers.append(_file_handler(log_file, FILE_FORMAT))
+        if console:
+            stream = logging.StreamHandler(sys.stderr)
+            stream.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+            stream.setLevel(logging.INFO)
+            _router.handlers.append(stream)
+
+        root = logging.getLogger(LOGGER_NAME)
+        root.setLevel(level or LOG_LEVEL)
+        root.addHandler(logging.handlers.QueueHandler(_queue))
+        root.propagate = False
+        for component, component_level in _parse_levels(LOG_LEVELS).items():
+            get_logger(component).setLevel(component_level)
+        for component, component_level in (levels or {}).items():
+            get_logger(component).setLevel(component_level)
+
+        _listener = logging.handlers.QueueListener(_queue, _router)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Drain the queue and flush the log files."""
+    global _listener
+    with _lock:
+        listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+    for handler in _router.handlers + list(_router.components.values()):
+        handler.flush()
@@ -0,0 +1,100 @@
+import os
+import re
+import ipaddress
+
+# Largest range accepted in one batch (a /16)
+MAX_BATCH_HOSTS = 65536
+
+# CIDR ranges are cut into subnets of at most this many addresses before sharding
+MAX_UNIT_HOSTS = 256
+
+# Most shards (nmap processes) one batch may run at once
+MAX_SHARDS = os.cpu_count() or 1
+
+# Options that would clash with the per-shard target lists and XML reports
+RESERVED_OPTIONS = ('-iL', '-iR', '-oX', '-oA', '-oN', '-oG', '-oS', '--resume')
+
+# nmap's periodic "--stats-every" line
+PROGRESS_LINE = re.compile(r'About ([\d.]+)% done')
+
+
+def parse_targets(text):
+    """Split free text (one target per line, or separated by commas/spaces) into targets.
+
+    Lines starting with ``#`` are comments, as in an nmap ``-iL`` file.
+    """
+    targets = []
+    for line in text.splitlines():
+        line = line.split('#', 1)[0]
+        targets.extend(part for part in re.split(r'[\s,]+', line) if part)
+    return targets
+
+
+def read_target_file(path):
+    """Targets listed in a file (same format as ``parse_targets``)."""
+    with open(path, 'r') as f:
+        return parse_targets(f.read())
+
+
+def _host_count(target):
+    try:
+        return ipaddress.ip_network(target, strict=False).num_addresses
+    except ValueError:
+        # A hostname or an nmap range like 10.0.0.1-20; nmap expands those itself
+        return 1
+
+
+def expand_targets(targets):
+    """Normalize a batch's targets into scan units.
+
+    Accepts a list of targets or a string in ``parse_targets`` format.
+    Duplicates are dropped, and CIDR ranges larger than MAX_UNIT_HOSTS
+    are cut into subnets so they can be spread over shards. Returns
+    (units, host_count) where each unit is (target, hosts).
+    """
+    if isinstance(targets, str):
+        targets = parse_targets(targets)
+    units, seen, total = [], set(), 0
+    for target in targets:
+        target = str(target).strip()
+        if not target or target in seen:
+            continue
+        if target.startswith('-'):
+            raise ValueError(f"Invalid target: {target}")
+        seen.add(target)
+        hosts = _host_count(target)
+        total += hosts
+        if total > MAX_BATCH_HOSTS:
+            raise ValueError(f"Batch covers more than {MAX_BATCH_HOSTS} addresses")
+        if hosts > MAX_UNIT_HOSTS:
+            network = ipaddress.ip_network(target, strict=False)
+            new_prefix = network.max_prefixlen - (MAX_UNIT_HOSTS.bit_length() - 1)
+            units.extend((str(subnet), subnet.num_addresses) for subnet in network.subnets(new_prefix=new_prefix))
+        else:
+            units.append((target, hosts))
+    return units, total
+
+
+def shard_targets(units, max_shards=None):
+    """Spread scan units over shards with roughly equal host counts.
+
+    The shard count defaults to the number of CPU cores and is clamped
+    to [1, MAX_SHARDS]. Returns a list of shards, each a dict with its
+    ``targets`` and ``hosts``.
+    """
+    max_shards = MAX_SHARDS if max_shards is None else max(1, min(int(max_shards), MAX_SHARDS))
+    count = max(1, min(max_shards, len(units)))
+    shards = [{'targets': [], 'hosts': 0} for _ in range(count)]
+    # Largest units first, each onto the lightest shard so far
+    for target, hosts in sorted(units, key=lambda unit: unit[1], reverse=True):
+        shard = min(shards, key=lambda shard: shard['hosts'])
+        shard['targets'].append(target)
+        shard['hosts'] += hosts
+    return [shard for shard in shards if shard['targets']]
+
+
+def check_options(options):
+    """Raise ValueError if options would override the batch's own input/output files."""
+    for option in options or []:
+        if option in RESERVED_OPTIONS:
+            raise ValueError(f"{option} can't be used in a batch scan")
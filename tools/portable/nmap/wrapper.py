@@ -1,13 +1,23 @@
-import subprocess
 import json
 import os
 import platform
 from pathlib import Path
-import logging
-import re
+import ipaddress
 import sqlite3
 import tempfile
 import shutil
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import xml.etree.ElementTree as ET
+from tools.portable.runner import run_streaming, strip_ansi, output_fields, OutputBuffer
+from tools.portable.history import ScanHistory
+from tools.portable.logs import get_logger, add_component_file
+from tools.portable.storage import connect, spill_dir, write_lock, write_stats
+from tools.portable.nmap.xml_results import iter_hosts
+from tools.portable.nmap.batch import expand_targets, shard_targets, check_options, PROGRESS_LINE, MAX_SHARDS
+
+logger = get_logger('nmap')
 
 class NmapWrapper:
     def __init__(self):
@@ -15,42 +25,76 @@ class NmapWrapper:
         self.db_file = self.tool_dir / 'config' / 'scan_history.sqlite'
         self.setup_logging()
         self.initialize_database()
+        self.history = ScanHistory(self.db_file, columns=('scan_type', 'options'), json_columns=('options',),
+                                   subsystem='history:nmap')
 
     def setup_logging(self):
-        log_file = self.tool_dir / 'nmap.log'
-        logging.basicConfig(
-            filename=str(log_file),
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s'
-        )
+        # Records go through the process-wide logging queue; this adds the tool's own file
+        add_component_file('nmap', self.tool_dir / 'nmap.log')
 
     def initialize_database(self):
-        if not self.db_file.exists():
-            conn = sqlite3.connect(str(self.db_file))
-            cursor = conn.cursor()
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS scan_history (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    target TEXT,
-                    scan_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    scan_type TEXT,
-                    options TEXT,
-                    results TEXT,
-                    status TEXT
-                )
-            ''')
-            conn.commit()
-            conn.close()
+        # Every statement is IF NOT EXISTS, so older databases gain the new tables
+        self.db_file.parent.mkdir(parents=True, exist_ok=True)
+        conn = connect(self.db_file)
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS scan_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                target TEXT,
+                scan_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                scan_type TEXT,
+                options TEXT,
+                results TEXT,
+                status TEXT
+            );
+            CREATE TABLE IF NOT EXISTS nmap_hosts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                scan_id INTEGER NOT NULL REFERENCES scan_history(id) ON DELETE CASCADE,
+                address TEXT,
+                addr_type TEXT,
+                hostname TEXT,
+                status TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_nmap_hosts_scan ON nmap_hosts (scan_id);
+            CREATE INDEX IF NOT EXISTS idx_nmap_hosts_address ON nmap_hosts (address);
+            CREATE INDEX IF NOT EXISTS idx_nmap_hosts_hostname ON nmap_hosts (hostname);
+            CREATE TABLE IF NOT EXISTS nmap_ports (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                host_id INTEGER NOT NULL REFERENCES nmap_hosts(id) ON DELETE CASCADE,
+                protocol TEXT,
+                port INTEGER,
+                state TEXT,
+                reason TEXT,
+                service TEXT,
+                product TEXT,
+                version TEXT,
+                extra_info TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_nmap_ports_lookup ON nmap_ports (port, protocol, state);
+            CREATE INDEX IF NOT EXISTS idx_nmap_ports_host ON nmap_ports (host_id);
+            CREATE INDEX IF NOT EXISTS idx_nmap_ports_service ON nmap_ports (service);
+            CREATE TABLE IF NOT EXISTS nmap_scripts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                host_id INTEGER NOT NULL REFERENCES nmap_hosts(id) ON DELETE CASCADE,
+                port_id INTEGER REFERENCES nmap_ports(id) ON DELETE CASCADE,
+                script_id TEXT,
+                output TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_nmap_scripts_host ON nmap_scripts (host_id);
+        ''')
+        conn.commit()
+        conn.close()
 
     def strip_ansi_codes(self, text):
-        ansi_escape = re.compile(r'\x1B\[[0-?]*[ -/]*[@-~]')
-        return ansi_escape.sub('', text)
+        return strip_ansi(text)
 
     def is_nmap_installed(self):
         return shutil.which('nmap') is not None
 
-    def run_scan(self, target, options=None):
-        """Run an nmap scan on the target with optional arguments."""
+    def run_scan(self, target, options=None, job=None):
+        """Run an nmap scan on the target with optional arguments.
+
+        When run as a job, the job's timeout and cancellation apply to the nmap process.
+        """
         if not self.is_nmap_installed():
             return {
                 'success': False,
@@ -61,73 +105,310 @@ class NmapWrapper:
             cmd = ['nmap']
             if options:
                 cmd.extend(options)
+            # Ask for an XML report alongside the normal output, unless the
+            # user already chose where XML output goes
+            xml_path = None
+            if not any(opt in ('-oX', '-oA') for opt in (options or [])):
+                fd, xml_path = tempfile.mkstemp(prefix='nmap-', suffix='.xml', dir=spill_dir('nmap'))
+                os.close(fd)
+                cmd.extend(['-oX', xml_path])
             cmd.append(target)
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
-            stdout, stderr = process.communicate()
-            # Strip ANSI codes
-            stdout = self.strip_ansi_codes(stdout)
-            stderr = self.strip_ansi_codes(stderr)
-            # Store results in database
-            self.store_scan_results(target, options, stdout, stderr, process.returncode)
+            try:
+                return_code, stdout, stderr, stats = run_streaming(cmd, job=job)
+                # Store results in database; the result only carries the end of the output
+                with stdout, stderr:
+                    scan_id = self.store_scan_results(target, options, stdout, stderr, return_code)
+                    fields = output_fields(stdout, stderr)
+                hosts_found = None
+                if scan_id is not None and xml_path is not None:
+                    hosts_found = self.store_structured_results(scan_id, xml_path)
+            finally:
+                if xml_path is not None and os.path.exists(xml_path):
+                    os.remove(xml_path)
             return {
-                'success': process.returncode == 0,
-                'stdout': stdout,
-                'stderr': stderr,
-                'return_code': process.returncode
+                'success': return_code == 0,
+                **fields,
+                'return_code': return_code,
+                'stats': stats,
+                'scan_id': scan_id,
+                'hosts_found': hosts_found
             }
         except Exception as e:
-            logging.error(f"Scan failed: {str(e)}")
+            logger.error("Scan failed: %s", e)
             return {
                 'success': False,
                 'error': str(e)
             }
 
-    def store_scan_results(self, target, options, stdout, stderr, return_code):
+    def run_batch_scan(self, targets, options=None, max_shards=None, job=None):
+        """Scan many targets (a list, CIDRs, or text from a target file) as parallel shards.
+
+        The targets are spread over up to one nmap process per CPU core
+        (or ``max_shards``), each with its own target list and XML report.
+        Per-shard progress is kept on the job, and the hosts of all shards
+        are stored under one history entry and merged into one report.
+        """
+        if not self.is_nmap_installed():
+            return {
+                'success': False,
+                'error': 'Nmap is not installed on this system. Please install nmap and try again.'
+            }
+        try:
+            check_options(options)
+            units, host_count = expand_targets(targets)
+            if not units:
+                return {'success': False, 'error': 'No targets given'}
+            shards = shard_targets(units, max_shards)
+            progress = {
+                'total': len(shards),
+                'completed': 0,
+                'hosts': host_count,
+                'shards': [{'index': index, 'targets': len(shard['targets']), 'hosts': shard['hosts'],
+                            'status': 'queued', 'percent': 0.0} for index, shard in enumerate(shards)]
+            }
+            if job is not None:
+                job.progress = progress
+            started = time.monotonic()
+            lock = threading.Lock()
+
+            def run_shard(index):
+                return self._run_shard(index, shards[index], options, progress, lock, job)
+
+            with ThreadPoolExecutor(max_workers=min(len(shards), MAX_SHARDS),
+                                    thread_name_prefix='nmap-shard') as executor:
+                results = list(executor.map(run_shard, range(len(shards))))
+
+            try:
+                return_code = next((result['return_code'] for result in results if result['return_code'] != 0), 0)
+
+                headers = [f"# Shard {index + 1}: {' '.join(shard['targets'])}\n" for index, shard in enumerate(shards)]
+
+                def combined(stream):
+                    # The shards' output one after the other, streamed from their buffers
+                    for header, result in zip(headers, results):
+                        if stream == 'stdout':
+                            yield header
+                        yield from result[stream]
+
+                # The result only carries the end of each shard's output
+                tails = [output_fields(result['stdout'], result['stderr']) for result in results]
+                fields = {'stdout': ''.join(header + tail['stdout'] for header, tail in zip(headers, tails)),
+                          'stderr': ''.join(tail['stderr'] for tail in tails)}
+                for stream in ('stdout', 'stderr'):
+                    if any(tail.get(f'{stream}_truncated') for tail in tails):
+                        fields[f'{stream}_truncated'] = True
+                target = ' '.join(target for target, _ in units) if len(units) <= 20 else \
+                    f"{' '.join(target for target, _ in units[:20])} (+{len(units) - 20} more)"
+                scan_id = self.store_scan_results(target, options, combined('stdout'), combined('stderr'),
+                                                  return_code, scan_type='nmap-batch')
+                report = {'hosts': [], 'hosts_up': 0, 'open_ports': 0}
+                hosts_found = 0
+                if scan_id is not None:
+                    for result in results:
+                        hosts_found += self.store_structured_results(
+                            scan_id, result['xml_path'], on_host=lambda host: self._add_to_report(report, host))
+            finally:
+                for result in results:
+                    result['stdout'].close()
+                    result['stderr'].close()
+                    if os.path.exists(result['xml_path']):
+                        os.remove(result['xml_path'])
+            report['hosts'].sort(key=lambda host: self._address_key(host['address']))
+            stats = {
+                'duration': round(time.monotonic() - started, 3),
+                'peak_rss_bytes': max((result['stats']['peak_rss_bytes'] or 0 for result in results), default=0),
+                'shards': len(shards)
+            }
+            if job is not None:
+                job.stats = stats
+            return {
+                'success': return_code == 0,
+                **fields,
+                'return_code': return_code,
+                'stats': stats,
+                'scan_id': scan_id,
+                'hosts_found': hosts_found,
+                'report': report
+            }
+        except ValueError as e:
+            return {
+                'success': False,
+                'error': str(e)
+            }
+        except Exception as e:
+            logger.error("Batch scan failed: %s", e)
+            return {
+                'success': False,
+                'error': str(e)
+            }
+
+    def _run_shard(self, index, shard, options, progress, lock, job):
+        shard_progress = progress['shards'][index]
+        fd, list_path = tempfile.mkstemp(prefix='nmap-targets-', suffix='.txt', dir=spill_dir('nmap'))
+        with os.fdopen(fd, 'w') as f:
+            f.write('\n'.join(shard['targets']) + '\n')
+        fd, xml_path = tempfile.mkstemp(prefix='nmap-', suffix='.xml', dir=spill_dir('nmap'))
+        os.close(fd)
+        cmd = ['nmap'] + list(options or []) + ['--stats-every', '10s', '-iL', list_path, '-oX', xml_path]
+
+        def on_line(stream, line):
+            match = PROGRESS_LINE.search(line)
+            if match:
+                shard_progress['percent'] = float(match.group(1))
+            if job is not None:
+                job.append_output(stream, f"[shard {index + 1}] {line}")
+
+        shard_progress['status'] = 'running'
+        try:
+            return_code, stdout, stderr, stats = run_streaming(cmd, job=job, on_line=on_line)
+        except Exception as e:
+            return_code, stdout, stderr, stats = -1, OutputBuffer(), OutputBuffer(), {'peak_rss_bytes': None}
+            stderr.write(str(e))
+        finally:
+            os.remove(list_path)
+        shard_progress['status'] = 'done' if return_code == 0 else 'failed'
+        shard_progress['percent'] = 100.0 if return_code == 0 else shard_progress['percent']
+        shard_progress['duration'] = stats.get('duration')
+        with lock:
+            progress['completed'] += 1
+        return {'return_code': return_code, 'stdout': stdout, 'stderr': stderr,
+                'stats': stats, 'xml_path': xml_path}
+
+    @staticmethod
+    def _add_to_report(report, host):
+        if host['status'] != 'up':
+            return
+        open_ports = [{'port': port['port'], 'protocol': port['protocol'], 'service': port['service'],
+                       'product': port['product'], 'version': port['version']}
+                      for port in host['ports'] if port['state'] == 'open']
+        report['hosts'].append({'address': host['address'], 'hostname': host['hostname'],
+                                'open_ports': open_ports})
+        report['hosts_up'] += 1
+        report['open_ports'] += len(open_ports)
+
+    @staticmethod
+    def _address_key(address):
+        try:
+            return (0, int(ipaddress.ip_address(address)))
+        except ValueError:
+            return (1, address or '')
+
+    def store_scan_results(self, target, options, stdout, stderr, return_code, scan_type='nmap'):
+        """Store scan results in the database (output is compressed separately)"""
         try:
-            conn = sqlite3.connect(str(self.db_file))
-            cursor = conn.cursor()
             status = 'success' if return_code == 0 else 'failed'
-            results = json.dumps({
-                'stdout': stdout,
-                'stderr': stderr,
-                'return_code': return_code
-            })
-            cursor.execute('''
-                INSERT INTO scan_history (target, scan_type, options, results, status)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (target, 'nmap', json.dumps(options), results, status))
-            conn.commit()
+            return self.history.record(target, status, stdout, stderr, return_code, scan_type=scan_type, options=options)
+        except Exception as e:
+            logger.error("Failed to store scan results: %s", e)
+            return None
+
+    def store_structured_results(self, scan_id, xml_path, on_host=None):
+        """Parse an nmap XML report into the host/port/script tables.
+
+        Hosts are streamed from the report one at a time and written in a
+        single transaction; ``on_host`` is called with each one. A
+        truncated report (e.g. a cancelled scan) keeps the hosts parsed
+        before the cut. Returns the host count.
+        """
+        if not os.path.exists(xml_path) or os.path.getsize(xml_path) == 0:
+            return 0
+        # The inserts form one write transaction; other writers of this database wait here
+        lock = write_lock(self.db_file)
+        lock.acquire()
+        conn = connect(self.db_file)
+        cursor = conn.cursor()
+        count = 0
+        try:
+            for host in iter_hosts(xml_path):
+                cursor.execute('''
+                    INSERT INTO nmap_hosts (scan_id, address, addr_type, hostname, status)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (scan_id, host['address'], host['addr_type'], host['hostname'], host['status']))
+                host_id = cursor.lastrowid
+                for port in host['ports']:
+                    cursor.execute('''
+                        INSERT INTO nmap_ports (host_id, protocol, port, state, reason,
+                                                service, product, version, extra_info)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ''', (host_id, port['protocol'], port['port'], port['state'], port['reason'],
+                          port['service'], port['product'], port['version'], port['extra_info']))
+                    port_id = cursor.lastrowid
+                    cursor.executemany('''
+                        INSERT INTO nmap_scripts (host_id, port_id, script_id, output)
+                        VALUES (?, ?, ?, ?)
+                    ''', [(host_id, port_id, script['id'], script['output']) for script in port['scripts']])
+                cursor.executemany('''
+                    INSERT INTO nmap_scripts (host_id, port_id, script_id, output)
+                    VALUES (?, NULL, ?, ?)
+                ''', [(host_id, script['id'], script['output']) for script in host['scripts']])
+                if on_host is not None:
+                    on_host(host)
+                count += 1
+        except ET.ParseError as e:
+            logger.warning("Incomplete nmap XML for scan %s: %s", scan_id, e)
+        except Exception as e:
+            logger.error("Failed to store structured results: %s", e)
+        finally:
+            with write_stats.track('history:nmap'):
+                conn.commit()
+            conn.close()
+            lock.release()
+        return count
+
+    def find_hosts(self, port, state='open', protocol='tcp', service=None, limit=100):
+        """Hosts seen with ``port/protocol`` in ``state``, newest scan first."""
+        try:
+            conn = connect(self.db_file)
+            conn.row_factory = sqlite3.Row
+            query = '''
+                SELECT h.address, h.hostname, p.port, p.protocol, p.state, p.service,
+                       p.product, p.version, s.id AS scan_id, s.scan_date
+                FROM nmap_ports p
+                JOIN nmap_hosts h ON h.id = p.host_id
+                JOIN scan_history s ON s.id = h.scan_id
+                WHERE p.port = ? AND p.protocol = ? AND p.state = ?
+            '''
+            params = [port, protocol, state]
+            if service:
+                query += ' AND p.service = ?'
+                params.append(service)
+            query += ' ORDER BY s.scan_date DESC, s.id DESC LIMIT ?'
+            params.append(limit)
+            rows = conn.execute(query, params).fetchall()
             conn.close()
+            return [dict(row) for row in rows]
         except Exception as e:
-            logging.error(f"Failed to store scan results: {str(e)}")
+            logger.error("Failed to query hosts: %s", e)
+            return []
 
-    def get_scan_history(self, limit=10):
+    def get_services(self, target):
+        """Distinct open services seen on a host (by address or hostname)."""
         try:
-            conn = sqlite3.connect(str(self.db_file))
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT target, scan_date, scan_type, options, results, status
-                FROM scan_history
-                ORDER BY scan_date DESC
-                LIMIT ?
-            ''', (limit,))
-            results = cursor.fetchall()
+            conn = connect(self.db_file)
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute('''
+                SELECT p.port, p.protocol, p.service, p.product, p.version,
+                       MAX(s.scan_date) AS last_seen, COUNT(*) AS times_seen
+                FROM nmap_hosts h
+                JOIN nmap_ports p ON p.host_id = h.id
+                JOIN scan_history s ON s.id = h.scan_id
+                WHERE (h.address = ? OR h.hostname = ?) AND p.state = 'open'
+                GROUP BY p.port, p.protocol, p.service, p.product, p.version
+                ORDER BY p.protocol, p.port
+            ''', (target, target)).fetchall()
             conn.close()
-            return [{
-                'target': row[0],
-                'scan_date': row[1],
-                'scan_type': row[2],
-                'options': json.loads(row[3]),
-                'results': json.loads(row[4]),
-                'status': row[5]
-            } for row in results]
+            return [dict(row) for row in rows]
+        except Exception as e:
+            logger.error("Failed to query services: %s", e)
+            return []
+
+    def get_scan_history(self, limit=10, **filters):
+        """Retrieve recent scan history (see ScanHistory.query for filters)"""
+        try:
+            scans, _ = self.history.query(limit=limit, **filters)
+            return scans
         except Exception as e:
-            logging.error(f"Failed to retrieve scan history: {str(e)}")
+            logger.error("Failed to retrieve scan history: %s", e)
             return []
 
 if __name__ == '__main__':
@@ -0,0 +1,62 @@
+import xml.etree.ElementTree as ET
+
+
+def _script(elem):
+    return {'id': elem.get('id'), 'output': elem.get('output')}
+
+
+def _port(elem):
+    state = elem.find('state')
+    service = elem.find('service')
+    return {
+        'protocol': elem.get('protocol'),
+        'port': int(elem.get('portid')),
+        'state': state.get('state') if state is not None else None,
+        'reason': state.get('reason') if state is not None else None,
+        'service': service.get('name') if service is not None else None,
+        'product': service.get('product') if service is not None else None,
+        'version': service.get('version') if service is not None else None,
+        'extra_info': service.get('extrainfo') if service is not None else None,
+        'scripts': [_script(script) for script in elem.findall('script')]
+    }
+
+
+def _host(elem):
+    address = None
+    addr_type = None
+    # Prefer the IP address over a MAC address
+    for addr in elem.findall('address'):
+        if address is None or addr.get('addrtype') in ('ipv4', 'ipv6'):
+            address = addr.get('addr')
+            addr_type = addr.get('addrtype')
+            if addr_type in ('ipv4', 'ipv6'):
+                break
+    hostname = elem.find('hostnames/hostname')
+    status = elem.find('status')
+    return {
+        'address': address,
+        'addr_type': addr_type,
+        'hostname': hostname.get('name') if hostname is not None else None,
+        'status': status.get('state') if status is not None else None,
+        'ports': [_port(port) for port in elem.findall('ports/port')],
+        'scripts': [_script(script) for script in elem.findall('hostscript/script')]
+    }
+
+
+def iter_hosts(source):
+    """Yield one dict per <host> in an nmap XML report.
+
+    The report is parsed incrementally and each host element is freed
+    once it has been converted, so memory stays flat however many hosts
+    the scan covered.
+    """
+    root = None
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = elem
+            continue
+        if elem.tag == 'host':
+            yield _host(elem)
+            elem.clear()
+            root.clear()
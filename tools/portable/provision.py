@@ -0,0 +1,164 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import threading
+import subprocess
+from pathlib import Path
+from tools.portable.logs import get_logger
+
+# Wheels shipped on the USB stick; tools are installed from here without network access
+WHEELHOUSE = Path(__file__).parent / 'wheelhouse'
+
+STAMP_NAME = '.cybercrate_ready.json'
+
+# After a failed install, scans fail fast for this long before pip is tried again
+RETRY_AFTER = 60
+
+
+def venv_bin(venv_path, name):
+    """Path of an executable inside a virtual environment."""
+    if os.name == 'nt':
+        return Path(venv_path) / 'Scripts' / (name + '.exe')
+    return Path(venv_path) / 'bin' / name
+
+
+class ToolProvisioner:
+    """Installs a tool's Python package into its own venv, once.
+
+    A successful install writes a readiness stamp into the venv with the
+    installed version and a hash of everything that went into it (the
+    requirement, the Python version and the wheelhouse contents). After
+    that, ``ensure()`` is a check of an in-memory flag; the stamp is only
+    read again in a new process, and a changed wheelhouse or requirement
+    triggers a reinstall.
+
+    Packages come from the local wheelhouse when it has any wheels, so
+    provisioning works offline; otherwise pip falls back to the index.
+    """
+
+    def __init__(self, name, venv_path, requirement, package, wheelhouse=WHEELHOUSE):
+        self.name = name
+        # Provisioning messages land in the tool's own log
+        self.logger = get_logger(name)
+        self.venv_path = Path(venv_path)
+        self.requirement = requirement
+        self.package = package
+        self.wheelhouse = Path(wheelhouse)
+        self.stamp_file = self.venv_path / STAMP_NAME
+        self.version = None
+        self.error = None
+        self._failed_at = None
+        self._ready = False
+        self._lock = threading.Lock()
+        self._warmup = None
+
+    @property
+    def python(self):
+        return venv_bin(self.venv_path, 'python')
+
+    def executable(self, name):
+        return venv_bin(self.venv_path, name)
+
+    def _wheels(self):
+        if not self.wheelhouse.is_dir():
+            return []
+        return sorted(entry for entry in os.scandir(self.wheelhouse)
+                      if entry.name.endswith(('.whl', '.tar.gz', '.zip')))
+
+    def input_hash(self):
+        """Hash of the requirement, interpreter version and wheelhouse contents."""
+        digest = hashlib.sha256()
+        digest.update(self.requirement.encode('utf-8'))
+        digest.update(sys.version.encode('utf-8'))
+        for entry in self._wheels():
+            digest.update(f'{entry.name}:{entry.stat().st_size}'.encode('utf-8'))
+        return digest.hexdigest()
+
+    def _read_stamp(self):
+        try:
+            with open(self.stamp_file, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def is_ready(self):
+        """True if the tool is installed and its stamp matches the current inputs."""
+        if self._ready:
+            return True
+        stamp = self._read_stamp()
+        if (stamp and stamp.get('hash') == self.input_hash() and
+                self.python.exists()):
+            self.version = stamp.get('version')
+            self._ready = True
+        return self._ready
+
+    def ensure(self):
+        """Install the tool if needed; return True once it is ready to run."""
+        if self._ready:
+            return True
+        with self._lock:
+            if self.is_ready():
+                return True
+            if self._failed_at is not None and time.time() - self._failed_at < RETRY_AFTER:
+                return False
+            try:
+                self._install()
+                self.error = None
+                self._failed_at = None
+                self._ready = True
+            except subprocess.CalledProcessError as e:
+                output = (e.stdout or '').strip().splitlines()
+                self.error = output[-1] if output else str(e)
+                self._failed_at = time.time()
+                self.logger.error("Provisioning %s failed: %s", self.name, self.error)
+            except Exception as e:
+                self.error = str(e)
+                self._failed_at = time.time()
+                self.logger.error("Provisioning %s failed: %s", self.name, e)
+            return self._ready
+
+    def _install(self):
+        if not self.python.exists():
+            self.logger.info("Creating virtual environment for %s...", self.name)
+            subprocess.run([sys.executable, '-m', 'venv', str(self.venv_path)], check=True)
+
+        cmd = [str(self.python), '-m', 'pip', 'install', '--disable-pip-version-check']
+        if self._wheels():
+            self.logger.info("Installing %s from %s...", self.name, self.wheelhouse)
+            cmd += ['--no-index', '--find-links', str(self.wheelhouse), self.package]
+        else:
+            self.logger.info("Installing %s from the package index...", self.name)
+            cmd.append(self.requirement)
+        subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+
+        version = subprocess.run(
+            [str(self.python), '-c',
+             f'import importlib.metadata as m; print(m.version({self.package!r}))'],
+            check=True, capture_output=True, text=True).stdout.strip()
+        stamp = {'package': self.package, 'requirement': self.requirement,
+                 'version': version, 'hash': self.input_hash()}
+        temp_path = self.stamp_file.with_name(STAMP_NAME + '.tmp')
+        with open(temp_path, 'w') as f:
+            json.dump(stamp, f, indent=2)
+        os.replace(temp_path, self.stamp_file)
+        self.version = version
+        self.logger.info("%s %s is ready", self.name, version)
+
+    def warmup(self):
+        """Provision in a background thread so the first scan doesn't wait for pip."""
+        with self._lock:
+            if self._warmup is None and not self._ready:
+                self._warmup = threading.Thread(target=self.ensure, daemon=True,
+                                                name=f'provision-{self.name}')
+                self._warmup.start()
+        return self._warmup
+
+    def status(self):
+        return {
+            'tool': self.name,
+            'ready': self._ready,
+            'version': self.version,
+            'error': self.error
+        }
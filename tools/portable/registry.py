@@ -0,0 +1,39 @@
+import importlib
+import threading
+
+
+class ToolRegistry:
+    """Tool wrappers by name, imported and created on first use.
+
+    Registering a tool only records where its wrapper class lives, so
+    starting the web UI doesn't import the wrappers or touch their
+    databases and log files until a tool page or scan needs them.
+    """
+
+    def __init__(self):
+        self._factories = {}
+        self._instances = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, target):
+        """Register ``target`` ('package.module:ClassName') under ``name``."""
+        self._factories[name] = target
+
+    def names(self):
+        return list(self._factories)
+
+    def loaded(self, name):
+        return name in self._instances
+
+    def get(self, name):
+        """The wrapper for ``name``, creating it on the first call."""
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+        with self._lock:
+            instance = self._instances.get(name)
+            if instance is None:
+                module_name, class_name = self._factories[name].split(':')
+                wrapper_class = getattr(importlib.import_module(module_name), class_name)
+                instance = self._instances[name] = wrapper_class()
+            return instance
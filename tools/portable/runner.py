@@ -0,0 +1,278 @@
+import os
+import re
+import sys
+import time
+import signal
+import tempfile
+import threading
+import subprocess
+from tools.portable.storage import spill_dir
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; scans there run without rlimits
+    resource = None
+
+ANSI_ESCAPE = re.compile(r'\x1B\[[0-?]*[ -/]*[@-~]')
+
+# Output kept in memory per stream before the rest is spilled to a temp file
+OUTPUT_MEMORY_BYTES = int(os.environ.get('CYBERCRATE_OUTPUT_MEMORY_MB', '4')) * 1024 * 1024
+# Output kept at all per stream; anything beyond this is counted and dropped
+OUTPUT_MAX_BYTES = int(os.environ.get('CYBERCRATE_OUTPUT_MAX_MB', '64')) * 1024 * 1024
+# Output per stream handed back in results; the full output only goes to the scan history
+RESULT_TAIL_BYTES = int(os.environ.get('CYBERCRATE_RESULT_OUTPUT_KB', '64')) * 1024
+# Stored output is read back in blocks of this size
+READ_BLOCK_BYTES = 64 * 1024
+
+# Default rlimits for scan processes (0 means no limit)
+SCAN_MEMORY_BYTES = int(os.environ.get('CYBERCRATE_SCAN_MEMORY_MB', '2048')) * 1024 * 1024
+SCAN_CPU_SECONDS = int(os.environ.get('CYBERCRATE_SCAN_CPU_SECONDS', '0'))
+
+
+def strip_ansi(text):
+    """Remove ANSI colour/cursor escape sequences."""
+    return ANSI_ESCAPE.sub('', text)
+
+
+def popen_kwargs():
+    """Extra Popen arguments so a scan can be killed together with its children."""
+    if os.name != 'nt':
+        return {'start_new_session': True}
+    return {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+
+
+def terminate_process(process):
+    """Kill a scan process and everything it started.
+
+    On POSIX the runner's reaper thread is the only one that waits for
+    the child, so this never calls poll()/wait() (or kill(), which
+    polls): a second waiter could reap it first and lose its exit code.
+    """
+    if process.returncode is not None:
+        return
+    if os.name == 'nt':
+        process.kill()
+        return
+    try:
+        # Scans run in their own session, so the whole group goes
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        # Gone already; the reaper collects it
+        pass
+    except PermissionError:
+        os.kill(process.pid, signal.SIGKILL)
+
+
+def limit_resources(process, memory_bytes=None, cpu_seconds=None):
+    """Apply rlimits to a started child with prlimit(2); return True if they were set.
+
+    The limits are set from outside rather than in a preexec_fn, which
+    can deadlock the fork in a process with threads (the server's, the
+    job pool's, the pipe readers'). The child may run for a moment
+    before they apply. Without prlimit (not Linux) scans run unlimited.
+    """
+    if resource is None or not hasattr(resource, 'prlimit') or not (memory_bytes or cpu_seconds):
+        return False
+    try:
+        if memory_bytes:
+            resource.prlimit(process.pid, resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+        if cpu_seconds:
+            # SIGXCPU at the soft limit, SIGKILL a little later
+            resource.prlimit(process.pid, resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 5))
+    except OSError:
+        # The child already exited
+        return False
+    return True
+
+
+class OutputBuffer:
+    """One output stream, held in memory up to ``memory_bytes`` and spilled to a temp file beyond.
+
+    At most ``max_bytes`` are kept; later lines are counted but dropped,
+    with a note at the end saying how much was cut. The output is never
+    read back whole: iterating yields it in blocks (for compression into
+    the scan history) and ``tail()`` returns its end for results.
+    """
+
+    def __init__(self, memory_bytes=OUTPUT_MEMORY_BYTES, max_bytes=OUTPUT_MAX_BYTES):
+        self.memory_bytes = memory_bytes
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.lines = 0
+        self.dropped_bytes = 0
+        self._file = tempfile.SpooledTemporaryFile(max_size=memory_bytes, mode='w+b',
+                                                 dir=spill_dir('output'))
+
+    @property
+    def spilled(self):
+        return self.bytes > self.memory_bytes
+
+    def write(self, line):
+        data = line.encode('utf-8', 'replace')
+        self.lines += 1
+        if self.max_bytes and self.bytes + len(data) > self.max_bytes:
+            self.dropped_bytes += len(data)
+            return
+        self._file.write(data)
+        self.bytes += len(data)
+
+    def _dropped_note(self):
+        return f"\n[... {self.dropped_bytes} bytes of output truncated ...]\n"
+
+    def __iter__(self):
+        self._file.seek(0)
+        for block in iter(lambda: self._file.read(READ_BLOCK_BYTES), b''):
+            yield block
+        if self.dropped_bytes:
+            yield self._dropped_note().encode('utf-8')
+
+    def tail(self, max_bytes=RESULT_TAIL_BYTES):
+        """Return (text, cut): the last ``max_bytes`` of the output, starting at a line."""
+        start = max(0, self.bytes - max_bytes)
+        self._file.seek(start)
+        data = self._file.read()
+        if start:
+            newline = data.find(b'\n')
+            if 0 <= newline < len(data) - 1:
+                data = data[newline + 1:]
+        text = data.decode('utf-8', 'replace')
+        if self.dropped_bytes:
+            text += self._dropped_note()
+        return text, bool(start or self.dropped_bytes)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def output_fields(stdout, stderr):
+    """Result entries for a run's output: the tail of each stream, flagged when it was cut."""
+    fields = {}
+    for name, buffer in (('stdout', stdout), ('stderr', stderr)):
+        fields[name], cut = buffer.tail()
+        if cut:
+            fields[f'{name}_truncated'] = True
+    return fields
+
+
+def _pump(stream_name, pipe, buffer, on_line):
+    # Lines are cleaned as they arrive, so only the stripped text is ever kept
+    with pipe:
+        for line in pipe:
+            line = strip_ansi(line)
+            buffer.write(line)
+            if on_line is not None:
+                on_line(stream_name, line)
+
+
+def _exit_code(status):
+    # Same convention as Popen.returncode: -N when killed by signal N
+    # (os.waitstatus_to_exitcode needs Python 3.9)
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def _reap(process, usage, done):
+    # The only waiter for the child on POSIX: wait4 reaps it and returns
+    # its own resource usage (peak RSS included)
+    try:
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = _exit_code(status)
+        usage.append(rusage)
+    finally:
+        done.set()
+
+
+def _peak_rss_bytes(rusage):
+    if rusage is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return rusage.ru_maxrss if sys.platform == 'darwin' else rusage.ru_maxrss * 1024
+
+
+def run_streaming(cmd, cwd=None, job=None, on_line=None, timeout=None,
+                  memory_bytes=SCAN_MEMORY_BYTES, cpu_seconds=SCAN_CPU_SECONDS):
+    """Run a command, handing each output line to ``on_line`` as it is produced.
+
+    stdout and stderr are read line by line on two threads and ANSI codes
+    are stripped per line. Each stream is buffered in memory up to
+    OUTPUT_MEMORY_BYTES and spilled to a temp file beyond that. The child
+    runs under the given rlimits and is killed (with its process group)
+    after ``timeout`` seconds. When a job is given its output buffer is
+    fed, its timeout applies too and cancelling it kills the process.
+
+    Returns (return_code, stdout, stderr, stats). stdout and stderr are
+    OutputBuffers that the caller closes (they are context managers);
+    stats has the duration, peak RSS, output sizes and whether output
+    spilled, was truncated or the run timed out.
+    """
+    if job is not None and on_line is None:
+        on_line = job.append_output
+    kwargs = popen_kwargs()
+    started = time.monotonic()
+    process = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        errors='replace',
+        bufsize=1,
+        cwd=cwd,
+        **kwargs
+    )
+    limit_resources(process, memory_bytes, cpu_seconds)
+    buffers = {'stdout': OutputBuffer(), 'stderr': OutputBuffer()}
+    readers = [
+        threading.Thread(target=_pump, args=(name, getattr(process, name), buffers[name], on_line), daemon=True)
+        for name in ('stdout', 'stderr')
+    ]
+    for reader in readers:
+        reader.start()
+    usage = []
+    exited = threading.Event()
+    if hasattr(os, 'wait4'):
+        threading.Thread(target=_reap, args=(process, usage, exited), daemon=True).start()
+    if job is not None:
+        job.attach_process(process)
+
+    deadlines = [limit for limit in (timeout, job.remaining_time() if job is not None else None)
+                 if limit is not None]
+    wait_for = min(deadlines) if deadlines else None
+    timed_out = False
+    try:
+        if hasattr(os, 'wait4'):
+            if not exited.wait(wait_for):
+                raise subprocess.TimeoutExpired(cmd, wait_for)
+        else:
+            process.wait(timeout=wait_for)
+    except subprocess.TimeoutExpired:
+        timed_out = True
+        if job is not None:
+            job.timed_out = True
+        terminate_process(process)
+        if hasattr(os, 'wait4'):
+            exited.wait()
+        else:
+            process.wait()
+    for reader in readers:
+        reader.join()
+
+    stats = {
+        'duration': round(time.monotonic() - started, 3),
+        'peak_rss_bytes': _peak_rss_bytes(usage[0] if usage else None),
+        'stdout_bytes': buffers['stdout'].bytes,
+        'stderr_bytes': buffers['stderr'].bytes,
+        'spilled': any(buffer.spilled for buffer in buffers.values()),
+        'truncated': any(buffer.dropped_bytes for buffer in buffers.values()),
+        'timed_out': timed_out
+    }
+    if job is not None:
+        job.stats = stats
+    return process.returncode, buffers['stdout'], buffers['stderr'], stats
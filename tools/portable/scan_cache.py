@@ -0,0 +1,82 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+def normalize_target(target):
+    """Targets that only differ in case or surrounding whitespace are the same scan."""
+    return str(target).strip().lower()
+
+
+def normalize_options(options):
+    """Order-independent form of a scan's options.
+
+    Lists are split into flags with their arguments (``['-p', '22']``
+    stays together) and sorted; dicts drop unset values and are sorted by
+    key (0 is a real value, only None, False and '' count as unset);
+    comma-separated strings (e.g. theHarvester sources) are sorted.
+    """
+    if options is None:
+        return ()
+    if isinstance(options, dict):
+        return tuple(sorted((str(key), normalize_options(value) if isinstance(value, (list, dict)) else value)
+                            for key, value in options.items()
+                            if not (value is None or value is False or value == '')))
+    if isinstance(options, (list, tuple)):
+        groups = []
+        for option in options:
+            option = str(option)
+            if option.startswith('-') or not groups:
+                groups.append([option])
+            else:
+                groups[-1].append(option)
+        return tuple(sorted(' '.join(group) for group in groups))
+    if isinstance(options, str) and ',' in options:
+        return tuple(sorted(part.strip().lower() for part in options.split(',') if part.strip()))
+    return options
+
+
+def scan_key(tool, target, *options):
+    """Cache key for a scan: (tool, normalized target, normalized options...)."""
+    return (tool, normalize_target(target)) + tuple(normalize_options(option) for option in options)
+
+
+class ResultCache:
+    """Finished scans by cache key, kept for ``ttl`` seconds.
+
+    Entries are the finished jobs themselves, so a cache hit can replay
+    the original output and reports when the scan actually ran. At most
+    ``max_entries`` are kept; the oldest go first.
+    """
+
+    def __init__(self, ttl=300, max_entries=64):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """The cached job for ``key``, or None if there is none or it expired."""
+        if self.ttl <= 0:
+            return None
+        with self._lock:
+            job = self._entries.get(key)
+            if job is None:
+                return None
+            if time.time() - job.finished_at > self.ttl:
+                del self._entries[key]
+                return None
+            return job
+
+    def put(self, key, job):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = job
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,308 @@
+import os
+import time
+import atexit
+import sqlite3
+import logging
+import logging.handlers
+import tempfile
+import threading
+import weakref
+from contextlib import contextmanager
+from pathlib import Path
+
+# Candidate scratch locations, RAM-backed ones first (CYBERCRATE_SCRATCH_DIR overrides them)
+SCRATCH_CANDIDATES = ('/dev/shm', os.environ.get('XDG_RUNTIME_DIR'), tempfile.gettempdir())
+
+# Candidate locations for output spilled out of memory; these must be disk-backed
+SPILL_CANDIDATES = (os.environ.get('CYBERCRATE_SPILL_DIR'), tempfile.gettempdir(), '/var/tmp')
+
+# File systems that keep their data in memory
+RAM_FILESYSTEMS = ('tmpfs', 'ramfs')
+
+# Buffered log lines are written at least this often, or sooner once this many bytes are pending
+FLUSH_INTERVAL = float(os.environ.get('CYBERCRATE_FLUSH_SECONDS', '2'))
+FLUSH_BYTES = 64 * 1024
+
+# Per-thread I/O accounting (Linux); write_bytes only counts data headed for a real device
+_THREAD_IO = '/proc/thread-self/io'
+
+
+def _thread_write_bytes():
+    try:
+        with open(_THREAD_IO, 'rb') as f:
+            for line in f:
+                if line.startswith(b'write_bytes:'):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+class WriteStats:
+    """Bytes written to persistent storage, per subsystem.
+
+    Where the kernel keeps per-thread I/O accounting, the bytes a block
+    of code really sends to the device are measured (writes to tmpfs
+    count as zero); elsewhere the caller's own byte count is used.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+        self.measured = _thread_write_bytes() is not None
+
+    def add(self, subsystem, nbytes, writes=1):
+        with self._lock:
+            entry = self._stats.setdefault(subsystem, {'bytes': 0, 'writes': 0})
+            entry['bytes'] += nbytes
+            entry['writes'] += writes
+
+    @contextmanager
+    def track(self, subsystem, nbytes=0):
+        """Attribute the writes done inside the block to ``subsystem``."""
+        before = _thread_write_bytes() if self.measured else None
+        try:
+            yield
+        finally:
+            after = _thread_write_bytes() if before is not None else None
+            self.add(subsystem, after - before if after is not None else nbytes)
+
+    def snapshot(self):
+        with self._lock:
+            return {name: dict(entry) for name, entry in sorted(self._stats.items())}
+
+
+write_stats = WriteStats()
+
+
+def process_bytes_written():
+    """Bytes this process has sent to storage devices, if the OS reports it."""
+    try:
+        with open('/proc/self/io', 'rb') as f:
+            for line in f:
+                if line.startswith(b'write_bytes:'):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def is_ram_backed(path):
+    """Whether ``path`` lives on a memory file system (tmpfs/ramfs)."""
+    try:
+        path = os.path.realpath(path)
+        best, fstype = '', None
+        with open('/proc/mounts', 'r') as f:
+            for line in f:
+                fields = line.split()
+                mount_point = fields[1].replace('\\040', ' ')
+                if (path == mount_point or path.startswith(mount_point.rstrip('/') + '/')) \
+                        and len(mount_point) >= len(best):
+                    best, fstype = mount_point, fields[2]
+        return fstype in RAM_FILESYSTEMS
+    except (OSError, IndexError):
+        return False
+
+
+_scratch = None
+_scratch_lock = threading.Lock()
+
+
+def _user_suffix():
+    return str(os.getuid()) if hasattr(os, 'getuid') else os.environ.get('USERNAME', 'user')
+
+
+def scratch_root():
+    """Return (directory, ram_backed) for throwaway data, chosen once per process.
+
+    Small temporary files that don't need to survive a reboot go to a
+    RAM-backed directory when one is writable instead of wearing out the
+    USB stick.
+    """
+    global _scratch
+    if _scratch is not None:
+        return _scratch
+    with _scratch_lock:
+        if _scratch is None:
+            override = os.environ.get('CYBERCRATE_SCRATCH_DIR')
+            candidates = [override] if override else \
+                [c for c in SCRATCH_CANDIDATES if c and is_ram_backed(c)] + [tempfile.gettempdir()]
+            for candidate in candidates:
+                root = Path(candidate) / f'cybercrate-{_user_suffix()}'
+                try:
+                    root.mkdir(mode=0o700, parents=True, exist_ok=True)
+                except OSError:
+                    continue
+                if os.access(root, os.W_OK):
+                    _scratch = (root, is_ram_backed(root))
+                    break
+            else:
+                _scratch = (Path(tempfile.gettempdir()), False)
+    return _scratch
+
+
+def scratch_dir(name):
+    """A named directory under the scratch root, created if needed."""
+    path = scratch_root()[0] / name
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+_spill = None
+
+
+def spill_dir(name):
+    """A named directory for large temporary data, on a disk-backed file system.
+
+    Spilled output and scan reports can grow with the scan, so unlike
+    scratch_dir() this skips tmpfs; the first writable disk-backed
+    candidate is used.
+    """
+    global _spill
+    if _spill is None:
+        with _scratch_lock:
+            if _spill is None:
+                for candidate in SPILL_CANDIDATES:
+                    if not candidate or is_ram_backed(candidate):
+                        continue
+                    root = Path(candidate) / f'cybercrate-{_user_suffix()}'
+                    try:
+                        root.mkdir(mode=0o700, parents=True, exist_ok=True)
+                    except OSError:
+                        continue
+                    if os.access(root, os.W_OK):
+                        _spill = root
+                        break
+                else:
+                    _spill = Path(tempfile.gettempdir())
+    path = _spill / name
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def connect(db_file, timeout=30, **kwargs):
+    """Open a SQLite database in WAL mode with relaxed syncing.
+
+    With synchronous=NORMAL a commit appends to the WAL without an
+    fsync; the file is only synced at checkpoints. A power cut can lose
+    the last commits but never corrupts the database.
+    """
+    conn = sqlite3.connect(str(db_file), timeout=timeout, **kwargs)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+_write_locks = {}
+_write_locks_guard = threading.Lock()
+
+
+def write_lock(db_file):
+    """Process-wide lock for writing to one database file.
+
+    SQLite allows a single writer at a time; serializing this process's
+    writers up front means concurrent requests queue here instead of
+    spinning on SQLITE_BUSY, and readers (WAL) are never blocked.
+    """
+    key = os.path.realpath(str(db_file))
+    with _write_locks_guard:
+        lock = _write_locks.get(key)
+        if lock is None:
+            lock = _write_locks[key] = threading.Lock()
+        return lock
+
+
+class _Flusher:
+    """One background thread flushing every registered buffer on a timer."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._targets = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, target):
+        with self._lock:
+            self._targets.add(target)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='write-flusher', daemon=True)
+                self._thread.start()
+
+    def discard(self, target):
+        with self._lock:
+            self._targets.discard(target)
+
+    def flush_all(self):
+        with self._lock:
+            targets = list(self._targets)
+        for target in targets:
+            try:
+                target.flush()
+            except Exception:
+                pass
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush_all()
+
+
+flusher = _Flusher(FLUSH_INTERVAL)
+atexit.register(flusher.flush_all)
+
+
+class CoalescingFileHandler(logging.handlers.RotatingFileHandler):
+    """Log file handler that batches records into few large appends.
+
+    Records are buffered and written every FLUSH_INTERVAL seconds, when
+    FLUSH_BYTES are pending, or straight away for errors, instead of one
+    write per log line. The file is opened on the first flush and, if
+    ``max_bytes`` is set, rotated before it would grow past it (keeping
+    ``backup_count`` old files).
+    """
+
+    def __init__(self, filename, subsystem=None, max_bytes=0, backup_count=0, encoding='utf-8'):
+        super().__init__(filename, mode='a', maxBytes=max_bytes, backupCount=backup_count,
+                         encoding=encoding, delay=True)
+        self.subsystem = subsystem or f'log:{Path(filename).stem}'
+        self._pending = []
+        self._pending_bytes = 0
+        flusher.add(self)
+
+    def emit(self, record):
+        try:
+            message = self.format(record) + self.terminator
+        except Exception:
+            self.handleError(record)
+            return
+        self._pending.append(message)
+        self._pending_bytes += len(message)
+        if record.levelno >= logging.ERROR or self._pending_bytes >= FLUSH_BYTES:
+            self.flush()
+
+    def flush(self):
+        self.acquire()
+        try:
+            if not self._pending:
+                return
+            data = ''.join(self._pending)
+            self._pending.clear()
+            self._pending_bytes = 0
+            with write_stats.track(self.subsystem, len(data)):
+                if self.stream is None:
+                    self.stream = self._open()
+                if self.maxBytes:
+                    self.stream.seek(0, 2)
+                    size = self.stream.tell()
+                    if size and size + len(data) > self.maxBytes:
+                        self.doRollover()
+                        self.stream = self._open()
+                self.stream.write(data)
+                self.stream.flush()
+        finally:
+            self.release()
+
+    def close(self):
+        flusher.discard(self)
+        self.flush()
+        super().close()
@@ -1,14 +1,17 @@
 import os
 import sys
 import json
-import sqlite3
-import subprocess
 from pathlib import Path
 import platform
-import logging
 import tempfile
 import shutil
-import re
+from tools.portable.runner import run_streaming, strip_ansi, output_fields
+from tools.portable.history import ScanHistory
+from tools.portable.logs import get_logger, add_component_file
+from tools.portable.storage import connect
+from tools.portable.provision import ToolProvisioner
+
+logger = get_logger('theharvester')
 
 class TheHarvesterWrapper:
     def __init__(self):
@@ -16,85 +19,55 @@ class TheHarvesterWrapper:
         self.config_file = self.tool_dir / 'config' / 'settings.json'
         self.db_file = self.tool_dir / 'config' / 'database.sqlite'
         self.venv_path = self.tool_dir / 'venv'
+        # theHarvester isn't on PyPI; the USB wheelhouse carries a wheel built from GitHub
+        self.provisioner = ToolProvisioner(
+            'theharvester', self.venv_path,
+            'theHarvester @ git+https://github.com/laramies/theHarvester.git', 'theHarvester')
         self.setup_logging()
+        self.initialize_database()
+        self.history = ScanHistory(self.db_file, columns=('sources',), subsystem='history:theharvester')
 
     def setup_logging(self):
         """Set up logging for the wrapper"""
-        log_file = self.tool_dir / 'theharvester.log'
-        logging.basicConfig(
-            filename=str(log_file),
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s'
-        )
+        # Records go through the process-wide logging queue; this adds the tool's own file
+        add_component_file('theharvester', self.tool_dir / 'theharvester.log')
 
     def setup_environment(self):
-        """Set up the complete environment for theHarvester"""
-        try:
-            print(f"Setting up environment in {self.venv_path}")
-            # Create virtual environment
-            if not self.venv_path.exists():
-                print("Creating virtual environment...")
-                # Use the system Python to create venv
-                subprocess.run(['python3', '-m', 'venv', str(self.venv_path)], check=True)
-
-            # Install requirements using the system pip
-            print("Installing theHarvester...")
-            # First uninstall any existing version
-            subprocess.run(['pip3', 'uninstall', '-y', 'theHarvester'], check=True)
-            # Install from GitHub
-            subprocess.run(['pip3', 'install', 'git+https://github.com/laramies/theHarvester.git'], check=True)
-
-            # Initialize database if it doesn't exist
-            self.initialize_database()
-
-            print("Environment setup completed successfully")
-            return True
-        except Exception as e:
-            print(f"Environment setup failed with error: {str(e)}")
-            print(f"Error type: {type(e)}")
-            import traceback
-            print(f"Traceback: {traceback.format_exc()}")
-            return False
+        """Make sure theHarvester is installed in its venv (a stamp check once it is)"""
+        return self.provisioner.ensure()
 
     def initialize_database(self):
         """Initialize the SQLite database with required tables"""
-        if not self.db_file.exists():
-            logging.info("Initializing database...")
-            conn = sqlite3.connect(str(self.db_file))
-            cursor = conn.cursor()
-            
-            # Create necessary tables
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS scan_history (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    target TEXT,
-                    scan_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    results TEXT,
-                    status TEXT,
-                    scan_type TEXT,
-                    sources TEXT
-                )
-            ''')
-            
-            conn.commit()
-            conn.close()
+        # The tables are created even if the file exists, as it may be empty
+        conn = connect(self.db_file)
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS scan_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                target TEXT,
+                scan_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                results TEXT,
+                status TEXT,
+                scan_type TEXT,
+                sources TEXT
+            )
+        ''')
+        conn.commit()
+        conn.close()
 
     def strip_ansi_codes(self, text):
-        ansi_escape = re.compile(r'\x1B\[[0-?]*[ -/]*[@-~]')
-        return ansi_escape.sub('', text)
+        return strip_ansi(text)
 
-    def run_scan(self, target, sources=None, options=None):
-        """Run a scan with theHarvester"""
+    def run_scan(self, target, sources=None, options=None, job=None):
+        """Run a scan with theHarvester (as a job, its timeout and cancellation apply)"""
         try:
-            print(f"[DEBUG] Raw target: {repr(target)}")
-            print(f"[DEBUG] Raw sources: {repr(sources)}")
-            print(f"[DEBUG] Raw options: {repr(options)}")
+            logger.debug("Raw target: %r, sources: %r, options: %r", target, sources, options)
             # Ensure environment is set up
             if not self.setup_environment():
                 raise Exception("Environment setup failed")
 
-            # Construct the command using system Python
-            cmd = ['theHarvester']
+            # Construct the command using the venv's theHarvester
+            cmd = [str(self.provisioner.executable('theHarvester'))]
             
             # Add required arguments
             cmd.extend(['-d', str(target)])
@@ -112,44 +85,33 @@ class TheHarvesterWrapper:
                 if options.get('output'):
                     cmd.extend(['-o', str(options['output'])])
 
-            print(f"[DEBUG] Final command list: {cmd}")
-            print(f"Running command: {' '.join(cmd)}")
+            logger.info("Running command: %s", ' '.join(cmd))
             
             # Run the scan
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                cwd=str(self.tool_dir)  # Set working directory to tool directory
-            )
-            stdout, stderr = process.communicate()
-
-            # Strip ANSI codes
-            stdout = self.strip_ansi_codes(stdout)
-            stderr = self.strip_ansi_codes(stderr)
+            return_code, stdout, stderr, stats = run_streaming(cmd, cwd=str(self.tool_dir), job=job)  # Set working directory to tool directory
 
-            print(f"Scan completed with return code: {process.returncode}")
-            print(f"Output: {stdout[:200]}...")  # Print first 200 chars of output
-            if stderr:
-                print(f"Error output: {stderr}")
+            # Store results in database; the response only carries the end of the output
+            with stdout, stderr:
+                scan_id = self.store_scan_results(target, stdout, stderr, return_code, sources)
+                fields = output_fields(stdout, stderr)
 
-            # Store results in database
-            self.store_scan_results(target, stdout, stderr, process.returncode, sources)
+            logger.info("Scan completed with return code: %s", return_code)
+            logger.debug("Output: %.200s...", fields['stdout'])
+            if fields['stderr']:
+                logger.warning("Error output: %s", fields['stderr'])
 
             # Return both stdout and stderr in the response
             return {
-                'success': process.returncode == 0,
-                'stdout': stdout,
-                'stderr': stderr,
-                'return_code': process.returncode,
+                'success': return_code == 0,
+                **fields,
+                'return_code': return_code,
+                'stats': stats,
+                'scan_id': scan_id,
                 'command': ' '.join(cmd)  # Include the command that was run
             }
         except Exception as e:
-            print(f"Scan failed with error: {str(e)}")
-            print(f"Error type: {type(e)}")
+            logger.exception("Scan failed with error: %s", e)
             import traceback
-            print(f"Traceback: {traceback.format_exc()}")
             return {
                 'success': False,
                 'error': str(e),
@@ -157,53 +119,21 @@ class TheHarvesterWrapper:
             }
 
     def store_scan_results(self, target, stdout, stderr, return_code, sources):
-        """Store scan results in the database"""
+        """Store scan results in the database (output is compressed separately); return the scan id"""
         try:
-            conn = sqlite3.connect(str(self.db_file))
-            cursor = conn.cursor()
-            
             status = 'success' if return_code == 0 else 'failed'
-            results = json.dumps({
-                'stdout': stdout,
-                'stderr': stderr,
-                'return_code': return_code
-            })
-            
-            cursor.execute('''
-                INSERT INTO scan_history (target, results, status, sources)
-                VALUES (?, ?, ?, ?)
-            ''', (target, results, status, sources))
-            
-            conn.commit()
-            conn.close()
+            return self.history.record(target, status, stdout, stderr, return_code, sources=sources)
         except Exception as e:
-            logging.error(f"Failed to store scan results: {str(e)}")
+            logger.error("Failed to store scan results: %s", e)
+            return None
 
-    def get_scan_history(self, limit=10):
-        """Retrieve recent scan history"""
+    def get_scan_history(self, limit=10, **filters):
+        """Retrieve recent scan history (see ScanHistory.query for filters)"""
         try:
-            conn = sqlite3.connect(str(self.db_file))
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT target, scan_date, status, sources, results
-                FROM scan_history
-                ORDER BY scan_date DESC
-                LIMIT ?
-            ''', (limit,))
-            
-            results = cursor.fetchall()
-            conn.close()
-            
-            return [{
-                'target': row[0],
-                'scan_date': row[1],
-                'status': row[2],
-                'sources': row[3],
-                'results': json.loads(row[4])
-            } for row in results]
+            scans, _ = self.history.query(limit=limit, **filters)
+            return scans
         except Exception as e:
-            logging.error(f"Failed to retrieve scan history: {str(e)}")
+            logger.error("Failed to retrieve scan history: %s", e)
             return []
 
 if __name__ == '__main__':